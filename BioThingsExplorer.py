@@ -1,61 +1,189 @@
-import matplotlib as mpl
+import random
+import sys
+
 import networkx as nx
-import visJS2jupyter.visJS_module
-from IPython.display import HTML, display
-import tabulate
 
 from api_handler import SmartAPIHandler
 from jsonld_processor import jsonld2nquads, fetchvalue
+from path_executor import PathExecutor
+from query_planner import QueryPlanner
+from reachability import ReachabilityIndex
+from result_store import ResultTable
+from transport import CircuitOpenError
+
+# find_path warns when more paths than this may connect start and end
+PATH_COUNT_WARNING = 10000
 
     
 class pathViewer:
-    def __init__(self):
+    def __init__(self, api_handler=None):
         self.graph_id = 5
-        self.api_handler = SmartAPIHandler()
+        self.api_handler = api_handler or SmartAPIHandler()
         # place holder for triples (input, endpoint, output)
         self.triples = []
+        # (input, endpoint, output) tuples of triples, for constant time membership checks
+        self.triple_index = set()
         self.paths = []
         self.selected_path = None
         self.final_results = {}
+        # ResultTable holding the records of the last find_output / explore_all_paths
+        self.result_table = ResultTable()
+        # Profiler report of the last find_output / explore_all_paths
+        self.last_report = None
+        # explore_all_paths runs paths cheapest first, as estimated from the reports of past explorations
+        self.planner = QueryPlanner()
+        self.api_handler.profiler.add_report_hook(self.planner.record)
+        # steps of the last explore_all_paths plan, see QueryPlanner.plan
+        self.last_plan = []
         self.start_point = ''
         self.G = None
+        # clustering and betweenness centrality of recently drawn graphs
+        self.metric_cache = {}
+        # directed graph of the api road map, built together with nodes and edges by show_api_road_map
+        self.api_map = nx.DiGraph()
+        # hop distances and path counts between the types of the road map, built together with it
+        self.reachability = ReachabilityIndex()
         self.edges = []
         self.nodes = []
         self.edge_relation_dict = {}
         self.node_to_color = {}
         self.filter = None
     
-    def draw_graph(self, nodes, edges, node_to_color=None, edge_relation_dict={}, edge_font_size = 10, edge_font_align="bottom"):
+    '''
+    render nodes and edges with visjs
+    metrics: 'exact' computes betweenness centrality and clustering on the whole graph, 'approx' estimates betweenness
+        from sample_size nodes and only computes clustering for them, 'none' skips both and colors nodes by degree,
+        'auto' picks 'exact' up to 500 nodes, 'approx' up to 5000 nodes and 'none' above
+    collapse_threshold: leaves hanging off a node with more neighbors than this are merged into one aggregate node per type
+    max_nodes: only the max_nodes best connected nodes are shown, the full graph stays available in self.G
+    '''
+    def draw_graph(self, nodes, edges, node_to_color=None, edge_relation_dict={}, edge_font_size = 10, edge_font_align="bottom",
+                   metrics='auto', sample_size=50, collapse_threshold=50, max_nodes=2000):
+        with self.api_handler.profiler.span('draw_graph'):
+            return self.render_graph(nodes, edges, node_to_color, edge_relation_dict, edge_font_size, edge_font_align,
+                                     metrics, sample_size, collapse_threshold, max_nodes)
+
+    def render_graph(self, nodes, edges, node_to_color, edge_relation_dict, edge_font_size, edge_font_align,
+                     metrics, sample_size, collapse_threshold, max_nodes):
         self.G = nx.Graph()
         self.G.add_nodes_from(nodes)
         self.G.add_edges_from(edges)
-        nodes = self.G.nodes()
+        edges = list(dict.fromkeys(edges))
         if not edge_relation_dict:
             edge_relation_dict = dict(zip(edges, ['is_related_to']*len(edges)))
-        cc = nx.clustering(self.G)
+        G = self.G
+        if collapse_threshold and len(G) > collapse_threshold:
+            (G, edges, edge_relation_dict, node_to_color) = self.collapse_fan_outs(G, edges, edge_relation_dict, node_to_color, collapse_threshold)
+        if max_nodes and len(G) > max_nodes:
+            print('showing the {} best connected of {} nodes, the full graph is kept in pathViewer.G'.format(max_nodes, len(G)), file=sys.stderr)
+            kept = set(sorted(G.nodes(), key=G.degree, reverse=True)[:max_nodes])
+            G = G.subgraph(kept)
+            edges = [_edge for _edge in edges if _edge[0] in kept and _edge[1] in kept]
+        nodes = G.nodes()
+        (cc, bc) = self.graph_metrics(G, edges, metrics, sample_size)
         degree = {}
         for _node in nodes:
             degree.update({_node: 1})
-        bc = nx.betweenness_centrality(self.G)
-        nx.set_node_attributes(self.G, 'clustering_coefficient', cc)
-        nx.set_node_attributes(self.G, 'degree', degree)
-        nx.set_node_attributes(self.G, 'betweenness_centrality', bc)
-        pos = nx.circular_layout(self.G)
+        G = nx.Graph(G)
+        nx.set_node_attributes(G, degree, 'degree')
+        if bc is not None:
+            nx.set_node_attributes(G, cc, 'clustering_coefficient')
+            nx.set_node_attributes(G, bc, 'betweenness_centrality')
+        else:
+            nx.set_node_attributes(G, nx.degree_centrality(G), 'degree_centrality')
+        pos = nx.circular_layout(G)
         # if user didn't specify the color of node, use the default one
         if not node_to_color:
-            node_to_color = visJS2jupyter.visJS_module.return_node_to_color(self.G, field_to_map='betweenness_centrality', cmap=mpl.cm.spring_r, alpha=1,
-                                                                            color_max_frac=.9, color_min_frac=.1)
+            node_to_color = self.color_nodes(G, bc is not None and 'betweenness_centrality' or 'degree_centrality')
         nodes_dict = [{"id": n, "color": node_to_color[n], "value": 2, "degree": 3, "x": pos[n][0]*1000, "y": pos[n][0]*1000} for n in nodes]
         node_map = dict(zip(nodes, range(len(nodes))))  # map to indices for source/target in edges
         edges_dict = [{"source": node_map[edges[i][0]], "target": node_map[edges[i][1]],
                       "color": "gray", "title": 'test', "id": edge_relation_dict[edges[i]]} for i in range(len(edges))]
         self.graph_id += 1
+        return self.render(nodes_dict, edges_dict, edge_font_size, edge_font_align)
+
+    '''
+    color of each node of G, from the value of its field_to_map attribute
+    visualization libraries are only loaded once something is drawn, so headless use never pays for them
+    '''
+    def color_nodes(self, G, field_to_map):
+        import matplotlib as mpl
+        import visJS2jupyter.visJS_module
+        return visJS2jupyter.visJS_module.return_node_to_color(G, field_to_map=field_to_map, cmap=mpl.cm.spring_r, alpha=1,
+                                                               color_max_frac=.9, color_min_frac=.1)
+
+    '''
+    visjs network of the node and edge payloads built by render_graph
+    '''
+    def render(self, nodes_dict, edges_dict, edge_font_size, edge_font_align):
+        import visJS2jupyter.visJS_module
         return visJS2jupyter.visJS_module.visjs_network(nodes_dict, edges_dict, graph_id=self.graph_id, edge_arrow_to=True, edge_arrow_to_scale_factor=0.4, node_font_size=15, node_font_align='left', edge_font_align=edge_font_align, edge_font_size = edge_font_size)
+
+    '''
+    clustering and betweenness centrality of G, (None, None) when metrics is 'none'
+    results are cached per set of edges, so re-rendering the same graph (e.g. the road map) is free
+    '''
+    def graph_metrics(self, G, edges, metrics, sample_size):
+        if metrics == 'auto':
+            metrics = len(G) <= 500 and 'exact' or len(G) <= 5000 and 'approx' or 'none'
+        if metrics == 'none':
+            return (None, None)
+        key = (metrics, sample_size, frozenset(G.nodes()), frozenset(edges))
+        if key not in self.metric_cache:
+            if len(self.metric_cache) >= 16:
+                self.metric_cache.pop(next(iter(self.metric_cache)))
+            if metrics == 'exact' or len(G) <= sample_size:
+                cc = nx.clustering(G)
+                bc = nx.betweenness_centrality(G)
+            else:
+                cc = nx.clustering(G, random.Random(0).sample(list(G.nodes()), sample_size))
+                bc = nx.betweenness_centrality(G, k=sample_size, seed=0)
+            self.metric_cache[key] = (cc, bc)
+        return self.metric_cache[key]
+
+    '''
+    merge the leaves of every node with more than threshold neighbors into one aggregate node per id prefix,
+    e.g. 500 "Variant:..." leaves of a gene become a single "500 Variants (Gene:1017)" node
+    '''
+    def collapse_fan_outs(self, G, edges, edge_relation_dict, node_to_color, threshold):
+        merged = {}
+        for _hub in [_node for _node in G.nodes() if G.degree(_node) > threshold]:
+            groups = {}
+            for _neighbor in G[_hub]:
+                if G.degree(_neighbor) == 1:
+                    groups.setdefault(str(_neighbor).split(':')[0] if ':' in str(_neighbor) else 'node', []).append(_neighbor)
+            for _prefix, _leaves in groups.items():
+                if len(_leaves) > 1:
+                    aggregate = '{} {}s ({})'.format(len(_leaves), _prefix, _hub)
+                    for _leaf in _leaves:
+                        merged[_leaf] = aggregate
+        if not merged:
+            return (G, edges, edge_relation_dict, node_to_color)
+        new_edges = []
+        relations = {}
+        for _edge in edges:
+            _new_edge = (merged.get(_edge[0], _edge[0]), merged.get(_edge[1], _edge[1]))
+            if _new_edge not in relations:
+                new_edges.append(_new_edge)
+                relations[_new_edge] = edge_relation_dict[_edge]
+            elif relations[_new_edge] != edge_relation_dict[_edge]:
+                relations[_new_edge] = 'multi'
+        if node_to_color:
+            node_to_color = dict(node_to_color)
+            for _leaf, _aggregate in merged.items():
+                node_to_color.setdefault(_aggregate, node_to_color[_leaf])
+        collapsed = nx.Graph()
+        collapsed.add_nodes_from(merged.get(_node, _node) for _node in G.nodes())
+        collapsed.add_edges_from(new_edges)
+        return (collapsed, new_edges, relations, node_to_color)
+
     '''
     show all available ids in the package, together with URI, description, identifeir pattern 
     and data type, e.g. entity/object
     '''
     def available_ids(self):
+        from IPython.display import HTML, display
+        import tabulate
         table = [['Preferred Name', 'URI', 'Description', 'Identifier pattern', 'Type']]
         for uri, info in self.api_handler.bioentity_info.items():
             table.append([info['preferred_name'], uri, info['description'], info['identifier_pattern'], info['type']])
@@ -71,33 +199,52 @@ class pathViewer:
         edges = []
         edge_relation_dict = {}
         node_to_color = {}
-        for _api, _info in self.api_handler.api_info.items():
-            nodes.append(_api)
-            node_to_color.update({_api: 'red'})
-            for _endpoint in _info['endpoints']:
-                nodes.append(_endpoint)
-                node_to_color.update({_endpoint: 'blue'})
-                _edge = (_api, _endpoint)
-                edges.append(_edge)
-                edge_relation_dict[_edge] = 'has_endpoint'
-        for _endpoint, _info in self.api_handler.endpoint_info.items():
-            input = _info['get']['parameters'][0]['x-valueType']
+        for _api in self.api_handler.api_info:
+            self.add_api_to_road_map(_api, nodes, edges, node_to_color, edge_relation_dict)
+        self.nodes = nodes
+        self.edges = edges
+        self.node_to_color = node_to_color
+        self.api_map = nx.DiGraph()
+        self.api_map.add_nodes_from(nodes)
+        self.api_map.add_edges_from(edges)
+        self.reachability = ReachabilityIndex(self.triples)
+        if display_graph:
+            return self.draw_graph(nodes, edges, node_to_color, edge_relation_dict, edge_font_size=5)
+
+    '''
+    append the nodes, edges and triples of an api and its endpoints to the road map being built
+    '''
+    def add_api_to_road_map(self, api, nodes, edges, node_to_color, edge_relation_dict):
+        nodes.append(api)
+        node_to_color.update({api: 'red'})
+        for _endpoint in self.api_handler.api_info[api]['endpoints']:
+            nodes.append(_endpoint)
+            node_to_color.update({_endpoint: 'blue'})
+            _edge = (api, _endpoint)
+            edges.append(_edge)
+            edge_relation_dict[_edge] = 'has_endpoint'
+        name_of_uri = self.api_handler.name_of_uri
+        for _endpoint in self.api_handler.api_info[api]['endpoints']:
+            _info = self.api_handler.endpoint_info[_endpoint]
+            input = [name_of_uri[_input] for _input in _info['get']['parameters'][0]['x-valueType']]
             output = _info['output']
             for _input in input:
-                nodes.append(self.api_handler.bioentity_info[_input]['preferred_name'])
-                node_to_color.update({self.api_handler.bioentity_info[_input]['preferred_name']: 'yellow'})
-                _edge = (self.api_handler.bioentity_info[_input]['preferred_name'], _endpoint)
+                nodes.append(_input)
+                node_to_color.update({_input: 'yellow'})
+                _edge = (_input, _endpoint)
                 edges.append(_edge)
                 if _edge not in edge_relation_dict:
                     edge_relation_dict[_edge] = ''
                     self.edge_relation_dict[_edge] = ''
                 for _output in output:
-                    if {'input': self.api_handler.bioentity_info[_input]['preferred_name'], 'endpoint': _endpoint, 'output': self.api_handler.bioentity_info[_output]['preferred_name']} not in self.triples:
-                        self.triples.append({'input': self.api_handler.bioentity_info[_input]['preferred_name'], 'endpoint': _endpoint, 'output': self.api_handler.bioentity_info[_output]['preferred_name']})
+                    _triple = (_input, _endpoint, name_of_uri[_output])
+                    if _triple not in self.triple_index:
+                        self.triple_index.add(_triple)
+                        self.triples.append({'input': _triple[0], 'endpoint': _triple[1], 'output': _triple[2]})
             for _output in output:
-                nodes.append(self.api_handler.bioentity_info[_output]['preferred_name'])
-                node_to_color.update({self.api_handler.bioentity_info[_output]['preferred_name']: 'yellow'})
-                _edge = (_endpoint, self.api_handler.bioentity_info[_output]['preferred_name'])
+                nodes.append(name_of_uri[_output])
+                node_to_color.update({name_of_uri[_output]: 'yellow'})
+                _edge = (_endpoint, name_of_uri[_output])
                 edges.append(_edge)
                 if len(_info['relation'][_output]) == 1:
                     edge_relation_dict[_edge] = _info['relation'][_output][0].split(':')[1]
@@ -105,35 +252,73 @@ class pathViewer:
                 else:
                     edge_relation_dict[_edge] = 'multi'
                     self.edge_relation_dict[_edge] = [_relation.split(':')[1] for _relation in _info['relation'][_output]]
-        self.nodes = nodes
-        self.edges = edges
-        self.node_to_color = node_to_color
-        if display_graph:
-            return self.draw_graph(nodes, edges, node_to_color, edge_relation_dict, edge_font_size=5)
-    
+
+    '''
+    refresh the registry of api_handler, then patch the road map with the apis added, removed or changed
+    the road map is only rebuilt from scratch when the bioentity types themselves changed
+    return the changes reported by SmartAPIHandler.refresh
+    '''
+    def refresh(self):
+        changes = self.api_handler.refresh()
+        if not self.nodes:
+            return changes
+        if changes['bioentities_changed']:
+            self.triples = []
+            self.triple_index = set()
+            self.edge_relation_dict = {}
+            self.show_api_road_map(display_graph=False)
+            return changes
+        dropped = set(changes['removed'] + changes['changed'] + changes['endpoints_removed'])
+        if dropped:
+            self.nodes = [_node for _node in self.nodes if _node not in dropped]
+            self.edges = [_edge for _edge in self.edges if _edge[0] not in dropped and _edge[1] not in dropped]
+            for _edge in [_edge for _edge in self.edge_relation_dict if _edge[0] in dropped or _edge[1] in dropped]:
+                del self.edge_relation_dict[_edge]
+            self.triples = [_triple for _triple in self.triples if _triple['endpoint'] not in dropped]
+            self.triple_index = {_triple for _triple in self.triple_index if _triple[1] not in dropped}
+            for _node in dropped:
+                self.node_to_color.pop(_node, None)
+                if _node in self.api_map:
+                    self.api_map.remove_node(_node)
+        nodes = []
+        edges = []
+        for _api in changes['added'] + changes['changed']:
+            self.add_api_to_road_map(_api, nodes, edges, self.node_to_color, {})
+        self.nodes += nodes
+        self.edges += edges
+        self.api_map.add_nodes_from(nodes)
+        self.api_map.add_edges_from(edges)
+        # bioentity types no endpoint refers to anymore
+        orphans = [_node for _node in self.api_map.nodes() if self.api_map.degree(_node) == 0]
+        if orphans:
+            self.api_map.remove_nodes_from(orphans)
+            orphans = set(orphans)
+            self.nodes = [_node for _node in self.nodes if _node not in orphans]
+            for _node in orphans:
+                self.node_to_color.pop(_node, None)
+        self.reachability = ReachabilityIndex(self.triples)
+        return changes
+
     def explore_api(self, api_name):
-        endpoint_nodes = []
         nodes = []
         edges = []
         node_to_color = {api_name: 'red'}
         edge_relation_dict = {}
-        for _edge in self.edges:
-            if _edge[0] == api_name:
-                endpoint_nodes.append(_edge[1])
-                nodes.append(_edge[1])
-                node_to_color[_edge[1]] = 'blue'
-                edges.append(_edge)
+        endpoint_nodes = list(self.api_map.successors(api_name)) if api_name in self.api_map else []
+        for _endpoint in endpoint_nodes:
+            nodes.append(_endpoint)
+            node_to_color[_endpoint] = 'blue'
+            edges.append((api_name, _endpoint))
         for _node in endpoint_nodes:
-            for _edge in self.edges:
-                if _edge[0] == _node:
-                    nodes.append(_edge[1])
-                    edges.append(_edge)
-                    node_to_color[_edge[1]] = 'yellow'
-                elif _edge[1] == _node:
-                    nodes.append(_edge[0])
-                    edges.append(_edge)
-                    if _edge[0] != api_name:
-                        node_to_color[_edge[0]] = 'yellow'
+            for _child in self.api_map.successors(_node):
+                nodes.append(_child)
+                edges.append((_node, _child))
+                node_to_color[_child] = 'yellow'
+            for _parent in self.api_map.predecessors(_node):
+                nodes.append(_parent)
+                edges.append((_parent, _node))
+                if _parent != api_name:
+                    node_to_color[_parent] = 'yellow'
         for _edge in edges:
             if _edge[0] == api_name:
                 edge_relation_dict[_edge] = 'has_endpoint'
@@ -180,94 +365,127 @@ class pathViewer:
         return (nodes, edges, edge_relation_dict)
 
     def find_children(self, node):
-        for _edge in self.edges:
-            if _edge[0] == node:
-                yield _edge[1]
+        return iter(self.api_map.successors(node))
+
+    '''
+    fewest apis a path from start to end goes through, and an upper bound of the number of paths find_path would list
+    for max_no_api_used, answered from the reachability index of the road map without any search
+    distance is None when end can't be reached from start
+    '''
+    def path_estimate(self, start, end, max_no_api_used=4):
+        return {'distance': self.reachability.distance(start, end),
+                'path_count': self.reachability.path_count(start, end, max_no_api_used)}
+
+    '''
+    bioentity types reachable from start through at most max_no_api_used apis, with the fewest apis needed for each
+    '''
+    def reachable_types(self, start, max_no_api_used=None):
+        return self.reachability.reachable(start, max_no_api_used)
 
-    def find_path(self, start, end, display_graph=True, max_no_api_used=4, intermediate_nodes=[], excluded_nodes=[], filter=None):
+    '''
+    list every path from start to end going through at most max_no_api_used apis
+    paths must go through all intermediate_nodes and avoid all excluded_nodes, both are checked during the search
+    queries the reachability index rules out return at once, and branches which can't reach end in time are not searched
+    limit: only list limit paths, skipping the first offset ones, the search stops as soon as they are found
+    '''
+    def find_path(self, start, end, display_graph=True, max_no_api_used=4, intermediate_nodes=[], excluded_nodes=[], filter=None,
+                  limit=None, offset=0):
         self.filter = filter
         cutoff = max_no_api_used * 2 + 1
         if cutoff < 1:
             print('please specify max_no_api_used with a number >= 1')
             return
-        if start not in self.nodes or end not in self.nodes:
+        if start not in self.api_map or end not in self.api_map:
             print('the start and end position is not in the api_map')
             return
+        if type(intermediate_nodes) != list:
+            intermediate_nodes = [intermediate_nodes]
+        for _node in intermediate_nodes:
+            if _node not in self.api_map:
+                print('the intermediate node is not in the map')
+                return
+        required = set(intermediate_nodes) - {start, end}
+        excluded = set(excluded_nodes)
+        if start in excluded or end in excluded:
+            return
+        # the index only covers paths between types
+        index = start in self.reachability.types and end in self.reachability.types and self.reachability or None
+        if index:
+            if not index.feasible(start, end, max_no_api_used, intermediate_nodes):
+                print('no path connects "{}" to "{}" through at most {} apis'.format(start, end, max_no_api_used))
+                return
+            path_count = index.path_count(start, end, max_no_api_used)
+            if path_count > PATH_COUNT_WARNING and not limit:
+                print('up to {} paths may connect "{}" to "{}" through at most {} apis, pass limit to only list some of them'.format(
+                    path_count, start, end, max_no_api_used))
+        # fewest edges left from each node to end
+        steps_to_end = {}
+        def room_for(child):
+            if not index:
+                return True
+            if child not in steps_to_end:
+                steps_to_end[child] = index.steps_to(child, end)
+            return steps_to_end[child] is not None and len(visited) + 1 + steps_to_end[child] <= cutoff
         visited = [start]
+        on_path = {start}
         stack = [self.find_children(start)]
-        paths = []
+        found = set()
         final_results = []
-        while stack:
-            children = stack[-1]
-            child = next(children, None)
+        while stack and not (limit and len(final_results) >= offset + limit):
+            child = next(stack[-1], None)
             if child is None:
                 stack.pop()
-                visited.pop()
-            elif len(visited) < cutoff:
-                if child == end:
-                    new_path = visited + [end]
-                    if new_path not in paths:
-                        paths.append(visited + [end])
-                elif child not in visited:
-                    visited.append(child)
-                    stack.append(self.find_children(child))
-            else: #len(visited) == cutoff:
-                if child == end or end in children:
-                    new_path = visited + [end]
-                    if new_path not in paths:
-                        paths.append(visited + [end])
-                stack.pop()
-                visited.pop()
-        if intermediate_nodes:
-            if type(intermediate_nodes)!=list:
-                intermediate_node = [intermediate_nodes]
-            for _node in intermediate_nodes:
-                if _node not in self.nodes:
-                    print('the intermediate node is not in the map')
-                    return
-            for _path in paths:
-                if set(intermediate_nodes) < set(_path):
-                    print('yes path: {}'.format(path))
-                    if excluded_nodes:
-                        if (set(_path) - set(excluded_nodes)) == set(_path):
-                            final_results.append(_path)
-                    else:
-                        final_results.append(_path)
-                else:
-                    return
-        else:
-            if excluded_nodes:
-                for _path in paths:
-                    if (set(_path) - set(excluded_nodes)) == set(_path):
-                        final_results.append(_path)
-            else:
-                final_results = paths
+                on_path.discard(visited.pop())
+            elif child == end:
+                if required <= on_path and tuple(visited) not in found:
+                    found.add(tuple(visited))
+                    final_results.append(visited + [end])
+            # a path must still leave room for end and every intermediate node not visited yet
+            elif child not in on_path and child not in excluded and len(visited) + 2 + len(required - on_path - {child}) <= cutoff \
+                    and room_for(child):
+                visited.append(child)
+                on_path.add(child)
+                stack.append(self.find_children(child))
+        final_results = final_results[offset:]
         if final_results:
             self.paths = final_results
             print('The following lists all paths connecting from "{}" to "{}":\n'.format(start, end))
             for i, _path in enumerate(final_results):
-                print('[Path {}]: {}\n'.format(i, ' -> '.join(_path)))
+                print('[Path {}]: {}\n'.format(offset + i, ' -> '.join(_path)))
+            if not display_graph:
+                return final_results
 
             (nodes, edges, edge_relation_dict) = self.create_node_edge_from_path(final_results, filter=filter)
 
             return self.draw_graph(nodes, edges, None, edge_relation_dict, edge_font_size=15)
 
-    def path_handler(self, path, value):
+    def path_handler(self, path, value, batch=True):
         result = []
         # convert id name to uri
-        for k, v in self.api_handler.bioentity_info.items():
-            if v['preferred_name'] == path['input']:
-                _input = k
-            elif v['preferred_name'] == path['output']:
-                _output = k
+        _input = self.api_handler.uri_of_name[path['input']]
+        _output = self.api_handler.uri_of_name[path['output']]
         if type(value) != list:
             value = [value]
-        # make api call with input and endpoint name
+        # make api call with input and endpoint name, several values at once if the endpoint takes batch queries
+        # ids are normalized, and ids met before in the session are not queried again
+        try:
+            with self.api_handler.profiler.span('hop', path['endpoint']):
+                responses = self.api_handler.resolve(_input, list(dict.fromkeys(value)), path['endpoint'], _output, batch=batch)
+        except CircuitOpenError:
+            # the api is degraded, leave it out rather than fail the whole query
+            self.api_handler.profiler.count('skipped', len(value), path['endpoint'])
+            return result
+        id_resolver = self.api_handler.id_resolver
         for _value in value:
-            (outputs, output_type) = self.api_handler.call_api(_input, _value, path['endpoint'], _output)
+            (outputs, output_type) = responses[_value]
             for output in outputs:
+                # entity outputs are [None] if nothing is found
+                if output is None:
+                    continue
                 if output_type == 'Entity':
-                    result.append((_value, output[0], output_type, output[1]))
+                    _id = id_resolver.normalize(_output, output[0])
+                    if _id is not None:
+                        result.append((_value, _id, output_type, output[1]))
                 else:
                     result.append((_value, output, output_type))
         return result
@@ -280,89 +498,210 @@ class pathViewer:
             i += 2
         return new_path
 
-    def explore_all_paths(self, value):
-        result = {}
+    '''
+    run the paths found by find_path for value, cheapest first according to self.planner
+    max_concurrency, max_per_api and timeout are passed to PathExecutor
+    without any limit every path runs at once, sharing api calls, otherwise paths run paths_per_wave at a time until
+    max_results: the last hops of the paths run so far returned at least max_results outputs
+    max_calls: the budget of api requests is spent, paths estimated to overrun it are not started,
+        paths already started always run to the end, see PathExecutor
+    max_paths: max_paths paths ran
+    '''
+    def explore_all_paths(self, value, max_concurrency=16, max_per_api=4, timeout=None,
+                          max_results=None, max_calls=None, max_paths=None, paths_per_wave=4):
         nodes = []
         edges = []
         node_to_color = {}
         color = ['yellow', 'blue', 'green', 'orange', 'pink', 'purple', 'brown']
         edge_relation_dict = {}
-        for i, _path in enumerate(self.paths):
-            _path = self.path_conversion(_path)
-            (_nodes, _edges, _edge_relation_dict, _result) = self.find_output(_path, value, display_graph=False)
+        if type(value) != list:
+            value = [value]
+        profiler = self.api_handler.profiler
+        profiler.reset()
+        all_paths = [self.path_conversion(_path) for _path in self.paths]
+        self.last_plan = self.planner.plan(all_paths, len(value), max_paths=max_paths, max_calls=max_calls,
+                                           request_count=self.api_handler.request_count)
+        executor = PathExecutor(self.path_handler, self.api_handler, max_concurrency=max_concurrency, max_per_api=max_per_api,
+                                timeout=timeout, max_calls=max_calls)
+        if max_results or max_calls or max_paths:
+            waves = [self.last_plan[i:i + paths_per_wave] for i in range(0, len(self.last_plan), paths_per_wave)]
+        else:
+            waves = [self.last_plan]
+        # responses of each path run, indexed by position in self.paths
+        path_results = {}
+        n_results = 0
+        with profiler.span('explore_all_paths'):
+            for _wave in waves:
+                for _step, _results in zip(_wave, executor.run([_step['path'] for _step in _wave], value)):
+                    if _results is None:
+                        continue
+                    path_results[_step['index']] = _results
+                    n_results += sum(len(_response) for (_hop, _), _response in _results.items() if _hop == len(_step['path']) - 1)
+                if (max_results and n_results >= max_results) or executor.exhausted:
+                    break
+        if len(path_results) < len(all_paths):
+            print('ran {} of {} paths, {} results from {} api requests'.format(len(path_results), len(all_paths), n_results, executor.sent), file=sys.stderr)
+        # results keep the name of their path in self.paths, even when some paths did not run
+        executed = sorted(path_results)
+        self.result_table = ResultTable()
+        for _index in executed:
+            self.result_table.add('path' + str(_index), all_paths[_index], value, self.hop_records(all_paths[_index], value, path_results[_index]),
+                                  self.output_types(all_paths[_index]))
+        seen = set()
+        for i, _index in enumerate(executed):
+            (_nodes, _edges, _edge_relation_dict, _result) = self.collect_output(all_paths[_index], value, self.result_table.iter_records('path' + str(_index)))
             for _node in _nodes:
-                if _node not in nodes:
-                    node_to_color.update({_node: color[i]})
+                if _node not in seen:
+                    seen.add(_node)
+                    node_to_color.update({_node: color[i % len(color)]})
                     nodes.append(_node)
                 else:
                     node_to_color.update({_node: 'red'})
             edges += _edges
-            result['path' + str(i)] = _result
             edge_relation_dict = {**_edge_relation_dict, **edge_relation_dict}
-        self.final_results = result
-        return self.draw_graph(nodes, edges, node_to_color, edge_relation_dict)
+        self.final_results = self.result_table.final_results()
+        for _name, _results in self.final_results.items():
+            profiler.count('final_results', sum(len(_outputs) for _outputs in _results.values()), _name)
+        graph = self.draw_graph(nodes, edges, node_to_color, edge_relation_dict)
+        self.last_report = profiler.publish()
+        return graph
 
 
-    def find_output(self, path, value, display_graph=True):
-        result = []
-        nodes = []
-        edges = []
-        object_id = 0
-        edge_relation_dict = {}
+    def find_output(self, path, value, display_graph=True, batch=True):
         self.selected_path = path
         self.start_point = value
-        self.final_results = {}
         if type(value) != list:
             value = [value]
-        for _value in value:
-            if len(path) == 1:
-                result = self.path_handler(path[0], _value)
-                if result[0][2] == 'Entity':
-                    self.final_results.update({_value: [(path[0]['output'] + ':' + _result[1]) for _result in result]})
-                else:
-                    self.final_results.update({_value: [_result[1] for _result in result]})
-                for _result in result:
-                    if _result[2] == 'Entity':
-                        nodes += [path[0]['input'] + ':' + _result[0], path[0]['output'] + ':' + _result[1]]
-                        edges += [(path[0]['input'] + ':' + _result[0], path[0]['output'] + ':' + _result[1])]
-                        edge_relation_dict[(path[0]['input'] + ':' + _result[0], path[0]['output'] + ':' + _result[1])] = _result[3]
-                    else:
-                        object_node = str(len(result)) + ' ' + path[-1]['output'] + 's'
-                        if object_node in nodes:
-                            object_node = str(len(result)) + ' ' + path[-1]['output'] + 's (' + str(object_id) + ')'
-                            object_id += 1
-                        nodes += [path[0]['input'] + ':' + _result[0], object_node]
-                        edges += [(path[0]['input'] + ':' + _result[0], object_node)]
-                        break
-            else:
-                _input = _value
-                for i, _path in enumerate(path):
-                    response = self.path_handler(_path, _input)
-                    result += response
-                    _input = [_response[1] for _response in response]
-                    if i == len(path) -1:
-                        if response[0][2] == 'Entity':
-                            self.final_results.update({_value: [_path['output'] + ':' + _inp for _inp in _input]})
-                        else:
-                            self.final_results.update({_value: _input})
-                    for _result in response:
-                        if _result[2] == 'Entity':
-                            nodes += [_path['input'] + ':' + _result[0], _path['output'] + ':' + _result[1]]
-                            edges += [(_path['input'] + ':' + _result[0], _path['output'] + ':' + _result[1])]
-                            edge_relation_dict[(_path['input'] + ':' + _result[0], _path['output'] + ':' + _result[1])] = _result[3]
-                        else:
-                            object_node = str(len(self.final_results[_value])) + ' ' + path[-1]['output'] + 's'
-                            if object_node in nodes:
-                                object_node = str(len(self.final_results[_value])) + ' ' + path[-1]['output'] + 's (' + str(object_id) + ')'
-                                object_id += 1
-                            nodes += [_path['input'] + ':' + _result[0], object_node]
-                            edges += [(_path['input'] + ':' + _result[0], object_node)]
-                            edge_relation_dict[(_path['input'] + ':' + _result[0], object_node)] = 'isRelatedTo'
-                            break
+        profiler = self.api_handler.profiler
+        profiler.reset()
+        self.result_table = ResultTable()
+        with profiler.span('find_output'):
+            self.result_table.add('path0', path, value, self.iter_output(path, value, batch=batch), self.output_types(path))
+        (nodes, edges, edge_relation_dict, _) = self.collect_output(path, value, self.result_table.iter_records('path0'))
+        self.final_results = self.result_table.final_results()['path0']
+        profiler.count('final_results', sum(len(_outputs) for _outputs in self.final_results.values()), 'path0')
         if display_graph:
-            return self.draw_graph(nodes, edges, None, edge_relation_dict)
+            graph = self.draw_graph(nodes, edges, None, edge_relation_dict)
         else:
-            return (nodes, edges, edge_relation_dict, self.final_results)
+            graph = (nodes, edges, edge_relation_dict, self.final_results)
+        self.last_report = profiler.publish()
+        return graph
+
+    '''
+    run a path for value, yield a (start value, hop index, input id, output id, relation) record for every output found
+    relation is None for object outputs
+    each hop is queried in chunks of batch_size inputs, records of a chunk are yielded before the next chunk is sent
+    '''
+    def iter_output(self, path, value, batch=True):
+        if type(value) != list:
+            value = [value]
+        chunk_size = batch and self.api_handler.batch_size or 1
+        # start values which reached each input of the current hop
+        reached = {_value: {_value: None} for _value in value}
+        for i, _path in enumerate(path):
+            next_reached = {}
+            inputs = list(reached)
+            for j in range(0, len(inputs), chunk_size):
+                for _response in self.path_handler(_path, inputs[j:j + chunk_size], batch=batch):
+                    for _value in reached[_response[0]]:
+                        yield (_value, i, _response[0], _response[1], _response[3] if _response[2] == 'Entity' else None)
+                        if i < len(path) - 1:
+                            next_reached.setdefault(_response[1], {})[_value] = None
+            reached = next_reached
+
+    '''
+    async version of iter_output, running the path through PathExecutor
+    records are yielded as soon as each api call returns, at most queue_size responses wait for the consumer
+    options are passed to PathExecutor
+    '''
+    async def aiter_output(self, path, value, queue_size=1000, **options):
+        if type(value) != list:
+            value = [value]
+        executor = PathExecutor(self.path_handler, self.api_handler, **options)
+        # responses and start values of each (hop index, input id)
+        responses = {}
+        reached = {}
+        # add a start value to an input, and list the records it gets from responses already received
+        def reach(hop, input, start):
+            starts = reached.setdefault((hop, input), {})
+            if start in starts:
+                return []
+            starts[start] = None
+            records = []
+            for _response in responses.get((hop, input), []):
+                records.append((start, hop, input, _response[1], _response[3] if _response[2] == 'Entity' else None))
+                if hop + 1 < len(path):
+                    records += reach(hop + 1, _response[1], start)
+            return records
+        for _value in value:
+            reach(0, _value, _value)
+        async for (_, hop, input, response) in executor.stream([path], value, queue_size):
+            responses[(hop, input)] = response
+            for _start in list(reached.get((hop, input), {})):
+                for _response in response:
+                    yield (_start, hop, input, _response[1], _response[3] if _response[2] == 'Entity' else None)
+                    if hop + 1 < len(path):
+                        for _record in reach(hop + 1, _response[1], _start):
+                            yield _record
+
+    '''
+    replay the responses collected by PathExecutor for one path as iter_output records
+    hop_results: responses of each hop indexed by (hop index, input id)
+    '''
+    def hop_records(self, path, value, hop_results):
+        for _value in dict.fromkeys(value):
+            reached = {_value: None}
+            for i, _path in enumerate(path):
+                next_reached = {}
+                for _input in reached:
+                    for _response in hop_results.get((i, _input), []):
+                        yield (_value, i, _input, _response[1], _response[3] if _response[2] == 'Entity' else None)
+                        if i < len(path) - 1:
+                            next_reached[_response[1]] = None
+                reached = next_reached
+
+    '''
+    bioentity type ('Entity' or 'Object') of the output of each hop of a path
+    '''
+    def output_types(self, path):
+        return [self.api_handler.bioentity_info[self.api_handler.uri_of_name[_path['output']]]['type'] for _path in path]
+
+    '''
+    consume iter_output records of a path, and build its graph and final results
+    '''
+    def collect_output(self, path, value, records):
+        nodes = []
+        edges = []
+        object_id = 0
+        edge_relation_dict = {}
+        final_results = {_value: [] for _value in value}
+        output_types = self.output_types(path)
+        # records of each start value and hop
+        responses = {}
+        for _record in records:
+            responses.setdefault((_record[0], _record[1]), []).append(_record)
+            if _record[1] == len(path) - 1:
+                if output_types[-1] == 'Entity':
+                    final_results[_record[0]].append(path[-1]['output'] + ':' + _record[3])
+                else:
+                    final_results[_record[0]].append(_record[3])
+        for (_value, i), response in responses.items():
+            _path = path[i]
+            for _result in response:
+                if output_types[i] == 'Entity':
+                    nodes += [_path['input'] + ':' + _result[2], _path['output'] + ':' + _result[3]]
+                    edges += [(_path['input'] + ':' + _result[2], _path['output'] + ':' + _result[3])]
+                    edge_relation_dict[(_path['input'] + ':' + _result[2], _path['output'] + ':' + _result[3])] = _result[4]
+                else:
+                    object_node = str(len(response)) + ' ' + path[-1]['output'] + 's'
+                    if object_node in nodes:
+                        object_node = str(len(response)) + ' ' + path[-1]['output'] + 's (' + str(object_id) + ')'
+                        object_id += 1
+                    nodes += [_path['input'] + ':' + _result[2], object_node]
+                    edges += [(_path['input'] + ':' + _result[2], object_node)]
+                    edge_relation_dict[(_path['input'] + ':' + _result[2], object_node)] = 'isRelatedTo'
+                    break
+        return (nodes, edges, edge_relation_dict, final_results)
 
     def result_summary(self):
         print("Your exploration starts from {}: {}. \n It goes through {} API Endpoints. \n The final output comes from API Endpoint {}. \n You can access the final output by calling the 'final_results' object in pathViewer Class.\n".format(self.selected_path[0]['input'], self.start_point, len(self.selected_path), self.selected_path[-1]['endpoint']))
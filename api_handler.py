@@ -1,21 +1,252 @@
 import requests
 import json
 import yaml
-import pandas as pd
 import pprint
-from jsonld_processor import jsonld2nquads, fetchvalue
-from utils import int2str
+import io
+import os
+import time
+import threading
+import hashlib
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from jsonld_processor import jsonld2nquads, fetchvalue, register_context, unregister_context, ContextExtractor
+from response_cache import ResponseCache
+from instrumentation import Profiler
+from transport import CircuitOpenError, get_default_transport
+from response_pool import PathAccessor, ResponsePool, loads, prepare_document, split_hits
+from id_resolver import IdResolver
+
+REGISTRY_URL_PREFIX = 'https://raw.githubusercontent.com/NCATS-Tangerine/translator-api-registry/kevin/'
+# bump this whenever the layout of the registry snapshot changes
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILE = 'registry_snapshot.json'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.biothings_explorer')
+
+def digest(content):
+    return hashlib.sha1(content).hexdigest()
 
 class SmartAPIHandler:
-    def __init__(self):
+    '''
+    cache_dir: folder holding the local registry snapshot, None to disable it
+    offline: only load the registry from the local snapshot, never touch the network
+    max_age: seconds a snapshot is trusted before it is revalidated against the registry
+    max_workers: number of registry files downloaded concurrently
+    max_per_host: number of concurrent downloads allowed against a single host
+    batch_size: default number of values sent per batch post request
+    response_cache: ResponseCache holding the results of api calls, defaults to an in-memory cache
+    profiler: Profiler collecting timings and counters of api calls and response processing
+    extraction_mode: how entity ids are pulled out of a response
+        'compiled' walks the response with the endpoint's compiled ContextExtractor
+        'nquads' converts the whole response to nquads and scans them
+        'conformance' runs both, reports any disagreement and returns the nquads result
+    registry_url: base url of the registry, holding API_LIST.yml, ID_MAPPING.csv and the openapi files
+    transport: Transport sending every request (timeouts, retries, rate limits and circuit breaking per api),
+        defaults to the one shared with jsonld_processor
+    processes: number of worker processes decoding responses and extracting their outputs, 0 to do it in this process
+    chunk_size: maximum number of responses handed to a worker process at once
+    id_resolver: IdResolver normalizing the ids passed between hops, see resolve
+    '''
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, offline=False, max_age=86400, max_workers=16, max_per_host=8,
+                 batch_size=1000, response_cache=None, profiler=None, extraction_mode='compiled', registry_url=REGISTRY_URL_PREFIX,
+                 transport=None, processes=0, chunk_size=16, id_resolver=None):
         # description info about endpoint, bioentity and api
         self.endpoint_info = {}
         self.bioentity_info = {}
         self.api_info = {}
-        self.parse_id_mapping()
-        self.parse_openapi()
+        self.registry_url = registry_url
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.max_age = max_age
+        # etag/last-modified headers of every registry file, indexed by url
+        self.validators = {}
+        # sha1 of the content of every registry file, indexed by url
+        self.hashes = {}
+        # title of the api described by each openapi file, indexed by openapi url
+        self.api_sources = {}
+        # jsonld context of each endpoint, fetched on first use
+        self.context_cache = {}
+        self.response_cache = response_cache or ResponseCache()
+        self.profiler = profiler or Profiler()
+        self.batch_size = batch_size
+        # batch size overrides for endpoints which can't take batch_size values at once, indexed by endpoint
+        self.batch_sizes = {}
+        self.extraction_mode = extraction_mode
+        # compiled ContextExtractor of each endpoint
+        self.extractors = {}
+        # (endpoint, output, ids only found by the extractor, ids only found through nquads)
+        self.conformance_failures = []
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.host_limits = {}
+        self.host_limits_lock = threading.Lock()
+        self.transport = transport or get_default_transport()
+        self.pool = processes and ResponsePool(processes, chunk_size) or None
+        # everything a worker process needs to handle the responses of an endpoint, indexed by (endpoint, output)
+        self.worker_specs = {}
+        self.id_resolver = id_resolver or IdResolver()
+        if not self.load_snapshot():
+            self.parse_id_mapping()
+            self.parse_openapi()
+            self.save_snapshot()
+        # output path accessors of each endpoint, indexed by endpoint then output uri
+        self.accessors = {}
+        self.compile_accessors()
+        self.build_indexes()
         self.relation = {}
 
+    '''
+    build the lookup tables used on every query
+    uri_of_name / name_of_uri map bioentity preferred names to uris and back
+    endpoint_index lists the endpoints taking an input uri and returning an output uri, indexed by input then output
+    the id patterns of id_resolver are compiled again as well
+    '''
+    def build_indexes(self):
+        self.name_of_uri = {_uri: _info['preferred_name'] for _uri, _info in self.bioentity_info.items()}
+        self.id_resolver.update(self.bioentity_info)
+        self.uri_of_name = {_name: _uri for _uri, _name in self.name_of_uri.items()}
+        self.endpoint_index = {}
+        for _endpoint in self.endpoint_info:
+            self.index_endpoint(_endpoint)
+
+    def index_endpoint(self, endpoint):
+        for _input in self.endpoint_info[endpoint]['get']['parameters'][0]['x-valueType']:
+            for _output in self.endpoint_info[endpoint]['output']:
+                self.endpoint_index.setdefault(_input, {}).setdefault(_output, []).append(endpoint)
+
+    def unindex_endpoint(self, endpoint):
+        for _input in self.endpoint_info[endpoint]['get']['parameters'][0]['x-valueType']:
+            for _output in self.endpoint_info[endpoint]['output']:
+                _endpoints = self.endpoint_index.get(_input, {}).get(_output, [])
+                if endpoint in _endpoints:
+                    _endpoints.remove(endpoint)
+
+    '''
+    compile the x-responseValueType path of every endpoint output into a PathAccessor
+    '''
+    def compile_accessors(self):
+        for _endpoint in self.endpoint_info:
+            self.compile_accessor(_endpoint)
+
+    def compile_accessor(self, endpoint):
+        self.accessors[endpoint] = {}
+        for _response in self.endpoint_info[endpoint]['get']['responses']['200']['x-responseValueType']:
+            self.accessors[endpoint][_response['valueType']] = PathAccessor(_response['path'])
+
+    '''
+    retrieve a registry file, and remember its etag/last-modified for later revalidation
+    '''
+    def fetch(self, url, headers=None):
+        with self.host_limit(url):
+            response = self.transport.get(url, headers=headers)
+        if response.status_code == 200:
+            validator = {}
+            if 'ETag' in response.headers:
+                validator['etag'] = response.headers['ETag']
+            if 'Last-Modified' in response.headers:
+                validator['last_modified'] = response.headers['Last-Modified']
+            self.validators[url] = validator
+        return response
+
+    '''
+    semaphore bounding the number of concurrent requests sent to the host of url
+    '''
+    def host_limit(self, url):
+        host = urlparse(url).netloc
+        with self.host_limits_lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_limits[host]
+
+    '''
+    retrieve a list of urls concurrently, each distinct url is only requested once
+    return a dict of responses indexed by url
+    '''
+    def fetch_all(self, urls):
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            return dict(zip(urls, executor.map(self.fetch, urls)))
+
+    def snapshot_path(self):
+        return os.path.join(self.cache_dir, SNAPSHOT_FILE)
+
+    '''
+    load endpoint/api/bioentity info from the local snapshot
+    return False if the snapshot is missing, outdated or changed upstream
+    '''
+    def load_snapshot(self):
+        if not self.cache_dir:
+            if self.offline:
+                raise RuntimeError('offline mode requires a cache_dir holding a registry snapshot')
+            return False
+        snapshot = None
+        if os.path.exists(self.snapshot_path()):
+            with open(self.snapshot_path()) as f:
+                snapshot = json.load(f)
+            # snapshots taken before registry_url was configurable all come from the default registry
+            if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('registry_url', REGISTRY_URL_PREFIX) != self.registry_url:
+                snapshot = None
+        if not snapshot:
+            if self.offline:
+                raise RuntimeError('no registry snapshot found in {}'.format(self.cache_dir))
+            return False
+        if not self.offline and time.time() - snapshot['created'] > self.max_age:
+            if not self.revalidate(snapshot['validators']):
+                return False
+            snapshot['created'] = time.time()
+            self.write_snapshot(snapshot)
+        self.endpoint_info = snapshot['endpoint_info']
+        self.api_info = snapshot['api_info']
+        self.bioentity_info = snapshot['bioentity_info']
+        self.validators = snapshot['validators']
+        self.hashes = snapshot['hashes']
+        self.api_sources = snapshot['api_sources']
+        return True
+
+    '''
+    send conditional requests for every registry file in the snapshot
+    return True only if none of them changed since the snapshot was taken
+    '''
+    def revalidate(self, validators):
+        headers = {}
+        for _url, _validator in validators.items():
+            headers[_url] = {}
+            if 'etag' in _validator:
+                headers[_url]['If-None-Match'] = _validator['etag']
+            if 'last_modified' in _validator:
+                headers[_url]['If-Modified-Since'] = _validator['last_modified']
+            # without any validator there is no way to tell whether the file changed
+            if not headers[_url]:
+                return False
+        def is_unchanged(url):
+            with self.host_limit(url):
+                return self.transport.get(url, headers=headers[url]).status_code == 304
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                return all(executor.map(is_unchanged, headers))
+        except requests.exceptions.RequestException:
+            print("registry unreachable, using the local snapshot: {}".format(self.snapshot_path()), file=sys.stderr)
+            return True
+
+    def save_snapshot(self):
+        if not self.cache_dir:
+            return
+        self.write_snapshot({'version': SNAPSHOT_VERSION, 'created': time.time(), 'registry_url': self.registry_url,
+                             'validators': self.validators, 'hashes': self.hashes, 'api_sources': self.api_sources,
+                             'endpoint_info': self.endpoint_info, 'api_info': self.api_info,
+                             'bioentity_info': self.bioentity_info})
+
+    def write_snapshot(self, snapshot):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write to a temporary file first so a crash never leaves a truncated snapshot behind
+        tmp_path = self.snapshot_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path())
+
     def find_base(self, d, relation={}):
         for k, v in d.items():
             if isinstance(v, dict) and "@context" in v and "@base" in v["@context"]:
@@ -30,38 +261,160 @@ class SmartAPIHandler:
     This function parse the jsonld file and return relation, output info
     '''
     def context2relation(self, context_url):
-        context = requests.get(context_url).json()
+        context = self.fetch(context_url).json()
         return self.find_base(context, relation={})
 
     '''
     This function parse the openapi yml file, and organize info into endpoints and apis
     '''
     def parse_openapi(self):
-        api_list_url = 'https://raw.githubusercontent.com/NCATS-Tangerine/translator-api-registry/kevin/API_LIST.yml'
-        api_list = yaml.load(requests.get(api_list_url).content)['APIs']
-        # path to fetch openapi yml file for each api
-        metadata_url_prefix = "https://raw.githubusercontent.com/NCATS-Tangerine/translator-api-registry/kevin/"
-        for _api in api_list:
-            openapi_url = metadata_url_prefix + _api['metadata']
+        self.load_apis(self.api_list())
+
+    '''
+    urls of the openapi files listed in API_LIST.yml
+    '''
+    def api_list(self):
+        api_list_url = self.registry_url + 'API_LIST.yml'
+        response = self.fetch(api_list_url)
+        self.hashes[api_list_url] = digest(response.content)
+        return list(dict.fromkeys(self.registry_url + _api['metadata'] for _api in yaml.safe_load(response.content)['APIs']))
+
+    '''
+    parse the openapi files of openapi_urls and add their apis, retrieving the files unless given as responses indexed by url
+    return the titles of the apis added
+    '''
+    def load_apis(self, openapi_urls, openapi_files=None):
+        # retrieve all openapi files at once
+        if openapi_files is None:
+            openapi_files = self.fetch_all(openapi_urls)
+        apis = {}
+        for openapi_url in openapi_urls:
             # check if the openapi file for the api exists first
-            if requests.get(openapi_url).status_code == 200:
-                # retrieve openapi file
-                openapi_file = requests.get(openapi_url).content
-                data = yaml.load(openapi_file)
-                self.api_info[data['info']['title']] = {'info': data['info'], 'servers': data['servers'], 'endpoints': []}
-                for _name, _info in data['paths'].items():
-                    self.endpoint_info[data['servers'][0]['url'] + _name] = _info
-                    _output = [_item['valueType'] for _item in _info['get']['responses']['200']['x-responseValueType']]
-                    relation = {}
-                    if 'x-JSONLDContext' in _info['get']['responses']['200']:
-                        relation = self.context2relation(_info['get']['responses']['200']['x-JSONLDContext'])
-                    for _op in _output:
-                        if _op not in relation:
-                            relation[_op] = ['ont:is_related_to']
-                    self.endpoint_info[data['servers'][0]['url'] + _name].update({'output': _output, 'relation': relation})
-                    self.api_info[data['info']['title']]['endpoints'].append(data['servers'][0]['url'] + _name)
+            if openapi_files[openapi_url].status_code == 200:
+                apis[openapi_url] = yaml.safe_load(openapi_files[openapi_url].content)
+                self.hashes[openapi_url] = digest(openapi_files[openapi_url].content)
             else:
-                print("invalid url for openapi: {}".format(openapi_url))
+                print("invalid url for openapi: {}".format(openapi_url), file=sys.stderr)
+        # then retrieve all jsonld context files referred to by any endpoint
+        context_urls = [_info['get']['responses']['200']['x-JSONLDContext'] for data in apis.values()
+                        for _info in data['paths'].values() if 'x-JSONLDContext' in _info['get']['responses']['200']]
+        contexts = self.fetch_all(context_urls)
+        for _url, _response in contexts.items():
+            self.hashes[_url] = digest(_response.content)
+        for openapi_url, data in apis.items():
+            self.add_api(openapi_url, data, contexts)
+        return [self.api_sources[_url] for _url in apis]
+
+    def add_api(self, openapi_url, data, contexts):
+        self.api_sources[openapi_url] = data['info']['title']
+        self.api_info[data['info']['title']] = {'info': data['info'], 'servers': data['servers'], 'endpoints': []}
+        for _name, _info in data['paths'].items():
+            self.endpoint_info[data['servers'][0]['url'] + _name] = _info
+            _output = [_item['valueType'] for _item in _info['get']['responses']['200']['x-responseValueType']]
+            relation = {}
+            if 'x-JSONLDContext' in _info['get']['responses']['200']:
+                relation = self.find_base(contexts[_info['get']['responses']['200']['x-JSONLDContext']].json(), relation={})
+            for _op in _output:
+                if _op not in relation:
+                    relation[_op] = ['ont:is_related_to']
+            self.endpoint_info[data['servers'][0]['url'] + _name].update({'output': _output, 'relation': relation})
+            self.api_info[data['info']['title']]['endpoints'].append(data['servers'][0]['url'] + _name)
+
+    '''
+    drop an api and everything derived from its endpoints
+    '''
+    def remove_api(self, title):
+        for _endpoint in self.api_info[title]['endpoints']:
+            if _endpoint in self.endpoint_info:
+                self.unindex_endpoint(_endpoint)
+                del self.endpoint_info[_endpoint]
+            for _cache in (self.accessors, self.extractors, self.context_cache, self.batch_sizes):
+                _cache.pop(_endpoint, None)
+            for _key in [_key for _key in self.worker_specs if _key[0] == _endpoint]:
+                del self.worker_specs[_key]
+        self.response_cache.discard(self.api_info[title]['endpoints'])
+        del self.api_info[title]
+
+    '''
+    registry files of the api described by openapi_url: the openapi file, then the jsonld contexts of its endpoints
+    '''
+    def api_files(self, openapi_url):
+        urls = [openapi_url]
+        for _endpoint in self.api_info[self.api_sources[openapi_url]]['endpoints']:
+            _context_url = self.endpoint_info[_endpoint]['get']['responses']['200'].get('x-JSONLDContext')
+            if _context_url and _context_url not in urls:
+                urls.append(_context_url)
+        return urls
+
+    '''
+    whether the registry file at url changed since it was last loaded
+    a conditional request is sent, and the content compared with its hash when the server does not answer 304
+    response is None when the file is unchanged
+    '''
+    def file_changed(self, url):
+        headers = {}
+        validator = self.validators.get(url, {})
+        if 'etag' in validator:
+            headers['If-None-Match'] = validator['etag']
+        if 'last_modified' in validator:
+            headers['If-Modified-Since'] = validator['last_modified']
+        response = self.fetch(url, headers=headers)
+        if response.status_code == 304 or (response.status_code == 200 and digest(response.content) == self.hashes.get(url)):
+            return (False, None)
+        return (True, response)
+
+    '''
+    bring the registry up to date without a full reload
+    API_LIST.yml is diffed against the loaded apis, and only the apis whose openapi file or jsonld contexts changed are parsed again
+    return the titles of the apis added, removed and changed, and the endpoints removed and added
+    '''
+    def refresh(self):
+        if self.offline:
+            raise RuntimeError('refresh needs the registry, which offline mode never touches')
+        changes = {'added': [], 'removed': [], 'changed': [], 'endpoints_removed': [], 'endpoints_added': [], 'bioentities_changed': False}
+        openapi_urls = self.api_list()
+        removed = [_url for _url in self.api_sources if _url not in openapi_urls]
+        added = [_url for _url in openapi_urls if _url not in self.api_sources]
+        kept = [_url for _url in openapi_urls if _url in self.api_sources]
+        urls = [self.registry_url + 'ID_MAPPING.csv'] + [_file for _url in kept for _file in self.api_files(_url)]
+        urls = list(dict.fromkeys(urls))
+        if urls:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+                changed_files = dict(zip(urls, executor.map(self.file_changed, urls)))
+        else:
+            changed_files = {}
+        (mapping_changed, mapping) = changed_files.pop(self.registry_url + 'ID_MAPPING.csv')
+        if mapping_changed:
+            self.bioentity_info = {}
+            self.parse_id_mapping(mapping)
+            changes['bioentities_changed'] = True
+        changed = [_url for _url in kept if any(changed_files[_file][0] for _file in self.api_files(_url))]
+        for _url in removed + changed:
+            # drop the contexts too, they are registered again when next used
+            for _context_url in self.api_files(_url)[1:]:
+                unregister_context(_context_url)
+            title = self.api_sources.pop(_url)
+            changes['endpoints_removed'] += self.api_info[title]['endpoints']
+            self.remove_api(title)
+            changes[_url in removed and 'removed' or 'changed'].append(title)
+        # openapi files fetched while checking for changes are reused, contexts are fetched again as a whole
+        openapi_files = {_url: changed_files[_url][1] for _url in changed if changed_files[_url][1] is not None}
+        if any(_url not in openapi_files for _url in changed):
+            openapi_files.update(self.fetch_all([_url for _url in changed if _url not in openapi_files]))
+        openapi_files.update(self.fetch_all(added))
+        for title in self.load_apis(added + changed, openapi_files):
+            if title not in changes['changed']:
+                changes['added'].append(title)
+            changes['endpoints_added'] += self.api_info[title]['endpoints']
+        for _endpoint in changes['endpoints_added']:
+            self.compile_accessor(_endpoint)
+        if mapping_changed:
+            self.build_indexes()
+        else:
+            for _endpoint in changes['endpoints_added']:
+                self.index_endpoint(_endpoint)
+        self.save_snapshot()
+        return changes
 
     '''
     construct requests params/data, based on input type and value
@@ -70,10 +423,12 @@ class SmartAPIHandler:
     def api_call_constructor(self, uri, value, endpoint_name):
         results = {}
         method = type(value) == list and 'post' or 'get'
+        # batch queries send all input values as one comma separated term
+        term = type(value) == list and ','.join(value) or value
         for _para in self.endpoint_info[endpoint_name][method]['parameters']:
             # handle cases where input value is part of the url
             if _para['in'] == 'path':
-                data = requests.get(endpoint_name.replace('{' + _para['name'] + '}', value))
+                data = self.transport.get(endpoint_name.replace('{' + _para['name'] + '}', value))
                 return data
             else:
                 # check whether the parameter is required
@@ -82,73 +437,281 @@ class SmartAPIHandler:
                     if 'x-requestTemplate' in _para:
                         for _template in _para['x-requestTemplate']:
                             if _template['valueType'] == 'default':
-                                results[_para['name']] = _template['template'].replace('{{input}}', value)
+                                results[_para['name']] = _template['template'].replace('{{input}}', term)
                             elif uri == _template['valueType']:
-                                results[_para['name']] = _template['template'].replace('{{input}}', value)
+                                results[_para['name']] = _template['template'].replace('{{input}}', term)
                     else:
-                        results[_para['name']] = value
+                        results[_para['name']] = term
         if type(value) != list:
-            data = requests.get(endpoint_name, params=results)
+            data = self.transport.get(endpoint_name, params=results)
         else:
-            data = requests.post(endpoint_name, data=results)
+            data = self.transport.post(endpoint_name, data=results)
         return data
   
     '''
     parse the uri_id mapping file, return a dict containing id mapping info indexed by uri
     '''
-    def parse_id_mapping(self):
-        file_url = 'https://raw.githubusercontent.com/NCATS-Tangerine/translator-api-registry/kevin/ID_MAPPING.csv'
-        data = pd.read_csv(file_url, encoding = "ISO-8859-1")
+    def parse_id_mapping(self, response=None):
+        file_url = self.registry_url + 'ID_MAPPING.csv'
+        response = response or self.fetch(file_url)
+        self.hashes[file_url] = digest(response.content)
+        # pandas is only needed when the registry is parsed, not when it is loaded from the snapshot
+        import pandas as pd
+        data = pd.read_csv(io.BytesIO(response.content), encoding = "ISO-8859-1")
         for index, row in data.iterrows():
-            self.bioentity_info[row['URI']] = {'registry_identifier': row[2], 'alternative_names': row[3], 'description': row[4], 'identifier_pattern': row[5], 'preferred_name': row[1], 'type': row[6]}
+            self.bioentity_info[row['URI']] = {'registry_identifier': row.iloc[2], 'alternative_names': row.iloc[3], 'description': row.iloc[4], 'identifier_pattern': row.iloc[5], 'preferred_name': row.iloc[1], 'type': row.iloc[6]}
         return self.bioentity_info
 
     '''
     fetch endpoint jsonld contextinformation
     '''
     def fetch_context(self, endpoint_name):
-        file_url = self.endpoint_info[endpoint_name]['get']['responses']['200']['x-JSONLDContext']
-        return requests.get(file_url).json()
+        if endpoint_name not in self.context_cache:
+            file_url = self.endpoint_info[endpoint_name]['get']['responses']['200']['x-JSONLDContext']
+            self.context_cache[endpoint_name] = self.transport.get(file_url).json()
+            register_context(file_url, self.context_cache[endpoint_name])
+        return self.context_cache[endpoint_name]
+
+    '''
+    compile the jsonld context of an endpoint into a ContextExtractor, only once per endpoint
+    '''
+    def get_extractor(self, endpoint_name):
+        if endpoint_name not in self.extractors:
+            self.extractors[endpoint_name] = ContextExtractor(self.fetch_context(endpoint_name))
+        return self.extractors[endpoint_name]
+
+    '''
+    extract output ids by converting the whole response to nquads
+    '''
+    def nquads_outputs(self, json_doc, endpoint_name, output):
+        self.fetch_context(endpoint_name)
+        with self.profiler.span('jsonld2nquads', endpoint_name):
+            nquads = jsonld2nquads(json_doc, self.endpoint_info[endpoint_name]['get']['responses']['200']['x-JSONLDContext'])
+        with self.profiler.span('fetchvalue', endpoint_name):
+            return list(set(fetchvalue(nquads, output)))
 
     '''
     input: user provide input/output
     output: return endpoint(s) which could take the input and return the output
     '''
     def api_endpoint_locator(self, input, output):
-        endpoint_list = []
-        for _endpoint, _info in self.endpoint_info.items():
-            if input in _info['get']['parameters'][0]['x-valueType'] and output in _info['output']:
-                endpoint_list.append(_endpoint)
-        return endpoint_list
+        return list(self.endpoint_index.get(input, {}).get(output, []))
 
     '''
     make api calls based on input, endpoint
     '''
     def call_api(self, input, value, endpoint, output):
-        json_doc = self.api_call_constructor(input, value, endpoint).json()
-        int2str(json_doc)
-        if endpoint.startswith('http://myvariant.info/'):
-            if "_id" in json_doc:
-                json_doc["_id"] = json_doc["_id"].replace(':', '-')
-            elif "hits" in json_doc:
-                for _doc in json_doc["hits"]:
-                    if "_id" in _doc:
-                        _doc['_id'] = _doc['_id'].replace(":", "-")
+        queried = []
+        def query():
+            queried.append(True)
+            if self.offloaded(endpoint, output):
+                return self.process_pooled(self.pool.submit(self.worker_spec(endpoint, output), self.request_content(input, value, endpoint)), endpoint)
+            return self.process_response(self.request_json(input, value, endpoint), endpoint, output)
+        result = self.response_cache.get_or_compute((endpoint, input, value, output), query)
+        self.profiler.count(queried and 'cache_misses' or 'cache_hits', 1, endpoint)
+        return result
+
+    '''
+    results of endpoint for every value, indexed by value, same format as call_api
+    values are normalized as ids of input first, so equivalent ids share a single call and a single response_cache entry
+    ids rejected by a strict id_resolver get no output, and so do ids whose call failed, see give_up
+    '''
+    def resolve(self, input, values, endpoint, output, batch=True):
+        canonical = {_value: self.id_resolver.normalize(input, _value) for _value in values}
+        invalid = [_value for _value, _id in canonical.items() if _id is None]
+        if invalid:
+            self.profiler.count('invalid_ids', len(invalid), endpoint)
+        ids = list(dict.fromkeys(_id for _id in canonical.values() if _id is not None))
+        if batch and len(ids) > 1 and self.supports_batch(endpoint):
+            fetched = self.call_api_batch(input, ids, endpoint, output)
+        else:
+            fetched = {}
+            for _id in ids:
+                try:
+                    fetched[_id] = self.call_api(input, _id, endpoint, output)
+                except CircuitOpenError:
+                    raise
+                except requests.exceptions.RequestException as e:
+                    self.give_up(endpoint, [_id], e)
+        empty = ([], self.bioentity_info[output]['type'])
+        return {_value: fetched.get(_id, empty) for _value, _id in canonical.items()}
+
+    '''
+    leave out values whose call failed for good, an api error only costs those values their outputs
+    a degraded api (CircuitOpenError) is still raised, so the whole hop is skipped
+    '''
+    def give_up(self, endpoint, values, error):
+        self.profiler.count('skipped', len(values), endpoint)
+        print('giving up on {} for {} inputs: {!r}'.format(endpoint, len(values), error), file=sys.stderr)
+
+    '''
+    send the request for value to endpoint and return the raw response, recording latency and size
+    raise HTTPError when the api still answers with an error once the transport gave up retrying,
+    so the error body is never parsed, and cached, as a response without outputs
+    '''
+    def request_content(self, input, value, endpoint):
+        with self.profiler.span('request', endpoint):
+            response = self.api_call_constructor(input, value, endpoint)
+        self.profiler.count('requests', 1, endpoint)
+        if not 200 <= response.status_code < 300:
+            self.profiler.count('errors', 1, endpoint)
+            raise requests.exceptions.HTTPError('{} {} from {}'.format(response.status_code, response.reason, endpoint), response=response)
+        self.profiler.count('bytes', len(response.content), endpoint)
+        return response.content
+
+    def request_json(self, input, value, endpoint):
+        return loads(self.request_content(input, value, endpoint))
+
+    '''
+    whether the responses of endpoint for output are processed by the worker processes
+    conformance checks compare both extraction modes, and always run here
+    '''
+    def offloaded(self, endpoint, output):
+        return self.pool is not None and self.extraction_mode != 'conformance'
+
+    '''
+    everything a worker needs to process a response of endpoint for output, see response_pool.extract_document
+    the same tuple is reused for every response, so it is only serialized once per chunk
+    '''
+    def worker_spec(self, endpoint, output):
+        if (endpoint, output) not in self.worker_specs:
+            output_type = self.bioentity_info[output]['type']
+            context_url = None
+            context_doc = None
+            if output_type == 'Entity':
+                context_doc = self.fetch_context(endpoint)
+                context_url = self.endpoint_info[endpoint]['get']['responses']['200']['x-JSONLDContext']
+            accessor = self.accessors[endpoint].get(output)
+            # workers rebuild their copy of a context whenever its version changes
+            self.worker_specs[(endpoint, output)] = (endpoint, output, output_type, self.extraction_mode, context_url,
+                                                     self.hashes.get(context_url, digest(json.dumps(context_doc).encode())),
+                                                     context_doc, accessor and accessor.path, self.wrapped(endpoint))
+        return self.worker_specs[(endpoint, output)]
+
+    '''
+    wait for the result of a response handed to the worker processes
+    '''
+    def process_pooled(self, future, endpoint):
+        with self.profiler.span('process', endpoint):
+            result = future.result()
+        # a worker processes a whole batch at once, values count the inputs processed
+        if isinstance(result, dict):
+            self.profiler.count('values', len(result), endpoint)
+            for _outputs, _ in result.values():
+                self.profiler.count('results', len([_output for _output in _outputs if _output is not None]), endpoint)
+        else:
+            self.profiler.count('values', 1, endpoint)
+            self.profiler.count('results', len([_output for _output in result[0] if _output is not None]), endpoint)
+        return result
+
+    '''
+    whether the api serving endpoint is degraded, i.e. its calls currently fail fast
+    '''
+    def is_degraded(self, endpoint):
+        return self.transport.is_degraded(endpoint)
+
+    '''
+    whether an endpoint accepts batch queries through post
+    '''
+    def supports_batch(self, endpoint):
+        return 'post' in self.endpoint_info[endpoint]
+
+    '''
+    number of requests resolve sends to endpoint for n_values values, cache hits aside
+    '''
+    def request_count(self, endpoint, n_values):
+        per_request = self.supports_batch(endpoint) and self.batch_sizes.get(endpoint, self.batch_size) or 1
+        return math.ceil(n_values / per_request)
+
+    '''
+    make batch api calls for a list of values, at most batch_size values per post request
+    return the result of each value indexed by value, same format as call_api
+    values of a failed batch are left out, see give_up
+    '''
+    def call_api_batch(self, input, values, endpoint, output, batch_size=None):
+        if not batch_size:
+            batch_size = self.batch_sizes.get(endpoint, self.batch_size)
+        results = {}
+        # only query the values which are not cached yet
+        if self.response_cache.enabled:
+            for _value in values:
+                (hit, cached) = self.response_cache.get((endpoint, input, _value, output))
+                if hit:
+                    results[_value] = cached
+            values = [_value for _value in values if _value not in results]
+            self.profiler.count('cache_hits', len(results), endpoint)
+            self.profiler.count('cache_misses', len(values), endpoint)
+        batches = [values[i:i + batch_size] for i in range(0, len(values), batch_size)]
+        if self.offloaded(endpoint, output):
+            # workers process each batch while the next one is being requested
+            futures = []
+            for _batch in batches:
+                try:
+                    futures.append(self.pool.submit(self.worker_spec(endpoint, output), self.request_content(input, _batch, endpoint), _batch))
+                except CircuitOpenError:
+                    raise
+                except requests.exceptions.RequestException as e:
+                    self.give_up(endpoint, _batch, e)
+            for _future in futures:
+                for _value, _result in self.process_pooled(_future, endpoint).items():
+                    results[_value] = _result
+                    if self.response_cache.enabled:
+                        self.response_cache.set((endpoint, input, _value, output), _result)
+            return results
+        for batch in batches:
+            try:
+                json_doc = self.request_json(input, batch, endpoint)
+            except CircuitOpenError:
+                raise
+            except requests.exceptions.RequestException as e:
+                self.give_up(endpoint, batch, e)
+                continue
+            docs = self.demultiplex(json_doc, batch, endpoint)
+            for _value in batch:
+                results[_value] = self.process_response(docs[_value], endpoint, output)
+                if self.response_cache.enabled:
+                    self.response_cache.set((endpoint, input, _value, output), results[_value])
+        return results
+
+    '''
+    split a batch response into one document per input value
+    biothings post responses are a list of hits, each carrying the input value it matched in "query"
+    the documents mimic the get response, wrapped in "hits" for query endpoints
+    '''
+    def demultiplex(self, json_doc, values, endpoint):
+        return split_hits(json_doc, values, self.wrapped(endpoint))
+
+    def wrapped(self, endpoint):
+        return any(_response['path'].split('.')[0] == 'hits' for _response in self.endpoint_info[endpoint]['get']['responses']['200']['x-responseValueType'])
+
+    '''
+    extract the output values from an api response document
+    '''
+    def process_response(self, json_doc, endpoint, output):
+        with self.profiler.span('process', endpoint):
+            (outputs, output_type) = self.extract_outputs(json_doc, endpoint, output)
+        self.profiler.count('values', 1, endpoint)
+        self.profiler.count('results', len([_output for _output in outputs if _output is not None]), endpoint)
+        return (outputs, output_type)
+
+    def extract_outputs(self, json_doc, endpoint, output):
+        prepare_document(json_doc, endpoint)
         output_type = self.bioentity_info[output]['type']
         if output_type == 'Entity':
-            jsonld_context = self.fetch_context(endpoint)
-            json_doc.update(jsonld_context)
-            # parse output nquads
-            nquads = jsonld2nquads(json_doc)
-            outputs = list(set(fetchvalue(nquads, output)))
+            if self.extraction_mode == 'nquads':
+                return (self.nquads_outputs(json_doc, endpoint, output), output_type)
+            with self.profiler.span('extract', endpoint):
+                outputs = self.get_extractor(endpoint).extract(json_doc, output)
+            if self.extraction_mode == 'conformance':
+                reference = self.nquads_outputs(json_doc, endpoint, output)
+                if set(outputs) != set(reference):
+                    self.conformance_failures.append((endpoint, output, set(outputs) - set(reference), set(reference) - set(outputs)))
+                    print("compiled extractor disagrees with nquads for {} -> {}".format(endpoint, output), file=sys.stderr)
+                outputs = reference
             return (outputs,output_type)
         else:
-            response = self.endpoint_info[endpoint]['get']['responses']['200']['x-responseValueType']
-            for _response in response:
-                if _response['valueType'] == output:
-                    output_path = _response['path']
-            outputs_command = 'json_doc'
-            for _item in output_path.split('.'):
-                outputs_command += ('["' + _item + '"]')
-            outputs = eval(outputs_command)
+            if output in self.accessors[endpoint]:
+                outputs = self.accessors[endpoint][output](json_doc)
+            else:
+                outputs = []
             return (outputs, output_type)
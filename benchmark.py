@@ -0,0 +1,323 @@
+'''
+Offline benchmarks for the explorer, every api and registry file is served by a local stub
+run with: python benchmark.py [benchmark ...] [--sizes 10 100 1000] [--repeat 5] [--latency 0.005]
+'''
+import argparse
+import contextlib
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+from pyld import jsonld
+
+from api_handler import SmartAPIHandler
+from id_resolver import IdResolver
+from instrumentation import Profiler
+from jsonld_processor import jsonld2nquads, jsonld2nquads_remote, register_context, fetchvalue, ContextExtractor, check_conformance
+from mock_registry import MockRegistry
+
+# seconds added to every api call of the mock registry, set with --latency
+MOCK_LATENCY = 0.005
+
+SAMPLE_CONTEXT_URL = 'http://localhost/context/mygene.jsonld'
+SAMPLE_CONTEXT = {'@context': {
+    'ont': 'http://biothings.io/explorer/vocab/ontology/',
+    'hits': {'@id': 'ont:hits', '@context': {
+        'entrezgene': {'@id': 'ont:ncbigene_of', '@type': '@id', '@context': {'@base': 'http://identifiers.org/ncbigene/'}},
+        'ensembl': {'@id': 'ont:ensembl_of', '@context': {
+            'gene': {'@id': 'ont:ensembl_gene_of', '@type': '@id', '@context': {'@base': 'http://identifiers.org/ensembl.gene/'}}}},
+        'uniprot': {'@id': 'ont:uniprot_of', '@context': {
+            'Swiss-Prot': {'@id': 'ont:uniprot_of', '@type': '@id', '@context': {'@base': 'http://identifiers.org/uniprot/'}}}}}}}}
+
+# id-bearing term defined at the top, reached through terms without a scoped context and through a scoped context inheriting it
+INHERITED_CONTEXT_URL = 'http://localhost/context/inherited.jsonld'
+INHERITED_CONTEXT = {'@context': {
+    'ont': 'http://biothings.io/explorer/vocab/ontology/',
+    'entrezgene': {'@id': 'ont:ncbigene_of', '@type': '@id', '@context': {'@base': 'http://identifiers.org/ncbigene/'}},
+    'hits': {'@id': 'ont:hits'},
+    'pathway': 'ont:pathway',
+    'ensembl': {'@id': 'ont:ensembl_of', '@context': {
+        'gene': {'@id': 'ont:ensembl_gene_of', '@type': '@id', '@context': {'@base': 'http://identifiers.org/ensembl.gene/'}}}}}}
+INHERITED_RESPONSE = {'hits': [{'entrezgene': '1017', 'pathway': {'entrezgene': '1018'}, 'ensembl': {'entrezgene': '1019', 'gene': 'ENSG1'}}]}
+
+'''
+build a mygene style query response with n_hits hits
+'''
+def sample_response(n_hits):
+    return {'hits': [{'_id': str(i), 'entrezgene': str(i), 'ensembl': {'gene': 'ENSG%011d' % i},
+                      'uniprot': {'Swiss-Prot': 'P%05d' % i}} for i in range(n_hits)]}
+
+
+class NquadsStubHandler(BaseHTTPRequestHandler):
+    '''
+    mimic the jsonld.biothings.io nquads service, including its log line
+    '''
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        doc = json.loads(parse_qs(body)['doc'][0].replace('&gt;', '>'))
+        start = time.time()
+        nquads = jsonld.to_rdf(doc, {'format': 'application/n-quads'})
+        output = 'Parsed 1 document in {} second.\n'.format(time.time() - start) + nquads
+        payload = json.dumps({'output': output}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+'''
+serve handler_class on a free local port in a background thread, return the server
+'''
+def start_stub(handler_class):
+    server = HTTPServer(('127.0.0.1', 0), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+'''
+time func over repeat runs, return the average number of seconds per run
+'''
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(name, seconds, unit_count=1, unit='doc'):
+    print('{:<45} {:>10.2f} ms {:>12.1f} {}/s'.format(name, seconds * 1000, unit_count / seconds, unit))
+
+
+'''
+compare in-process jsonld -> nquads conversion with the remote service round-trip
+'''
+def bench_jsonld2nquads(sizes, repeat):
+    server = start_stub(NquadsStubHandler)
+    service_url = 'http://127.0.0.1:{}/?action=nquads'.format(server.server_port)
+    register_context(SAMPLE_CONTEXT_URL, SAMPLE_CONTEXT)
+    for n_hits in sizes:
+        doc = sample_response(n_hits)
+        remote_doc = dict(doc, **SAMPLE_CONTEXT)
+        local = fetchvalue(jsonld2nquads(doc, SAMPLE_CONTEXT_URL), 'http://identifiers.org/ncbigene/')
+        remote = fetchvalue(jsonld2nquads_remote(remote_doc, service_url), 'http://identifiers.org/ncbigene/')
+        assert sorted(local) == sorted(remote), 'local and remote nquads disagree'
+        report('jsonld2nquads remote stub ({} hits)'.format(n_hits),
+               timeit(lambda: jsonld2nquads_remote(remote_doc, service_url), repeat))
+        report('jsonld2nquads local ({} hits)'.format(n_hits),
+               timeit(lambda: jsonld2nquads(doc, SAMPLE_CONTEXT_URL), repeat))
+    server.shutdown()
+
+
+'''
+compare the compiled context extractor with nquads conversion + fetchvalue, checking they agree
+'''
+def bench_extractor(sizes, repeat):
+    register_context(SAMPLE_CONTEXT_URL, SAMPLE_CONTEXT)
+    extractor = ContextExtractor(SAMPLE_CONTEXT)
+    object_uri = 'http://identifiers.org/ncbigene/'
+    register_context(INHERITED_CONTEXT_URL, INHERITED_CONTEXT)
+    assert check_conformance(INHERITED_RESPONSE, INHERITED_CONTEXT_URL, object_uri) == (set(), set()), \
+        'extractor disagrees with nquads on inherited terms'
+    for n_hits in sizes:
+        doc = sample_response(n_hits)
+        assert check_conformance(doc, SAMPLE_CONTEXT_URL, object_uri, extractor) == (set(), set()), 'extractor disagrees with nquads'
+        report('nquads + fetchvalue ({} hits)'.format(n_hits),
+               timeit(lambda: fetchvalue(jsonld2nquads(doc, SAMPLE_CONTEXT_URL), object_uri), repeat))
+        report('compiled extractor ({} hits)'.format(n_hits),
+               timeit(lambda: extractor.extract(doc, object_uri), repeat))
+
+
+class SyntheticRegistry(SmartAPIHandler):
+    '''
+    SmartAPIHandler holding a random registry of n_endpoints endpoints
+    spread over n_apis apis and n_types bioentity types, instead of the real one
+    only the registry is set up, no api can be called
+    '''
+    def __init__(self, n_endpoints, n_apis=None, n_types=None, seed=0):
+        rng = random.Random(seed)
+        n_apis = n_apis or max(1, n_endpoints // 10)
+        n_types = n_types or max(3, int(n_endpoints ** 0.5))
+        self.bioentity_info = {}
+        for i in range(n_types):
+            self.bioentity_info['http://identifiers.org/type{}/'.format(i)] = {'preferred_name': 'Type{}'.format(i), 'type': 'Entity',
+                                                                             'identifier_pattern': None, 'description': '', 'registry_identifier': ''}
+        uris = list(self.bioentity_info)
+        self.api_info = {}
+        self.endpoint_info = {}
+        for i in range(n_endpoints):
+            api = 'API{}'.format(i % n_apis)
+            endpoint = 'http://api{}.example.org/endpoint{}'.format(i % n_apis, i)
+            _inputs = rng.sample(uris, 1)
+            _outputs = rng.sample(uris, rng.randint(1, 3))
+            self.api_info.setdefault(api, {'info': {}, 'servers': [], 'endpoints': []})['endpoints'].append(endpoint)
+            self.endpoint_info[endpoint] = {'get': {'parameters': [{'x-valueType': _inputs}], 'responses': {'200': {'x-responseValueType': []}}},
+                                            'output': _outputs, 'relation': {_output: ['ont:is_related_to'] for _output in _outputs}}
+        self.profiler = Profiler()
+        self.id_resolver = IdResolver()
+        self.accessors = {}
+        self.compile_accessors()
+        self.build_indexes()
+
+
+'''
+build the api road map of synthetic registries and enumerate paths between two types
+'''
+def bench_find_path(sizes, repeat):
+    from BioThingsExplorer import pathViewer
+    for n_endpoints in sizes:
+        viewer = pathViewer(api_handler=SyntheticRegistry(n_endpoints))
+        report('show_api_road_map ({} endpoints)'.format(n_endpoints),
+               timeit(lambda: viewer.show_api_road_map(display_graph=False), repeat), 1, 'map')
+        for max_no_api_used in (2, 3):
+            paths = []
+            def find_path():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    paths[:] = viewer.find_path('Type0', 'Type1', display_graph=False, max_no_api_used=max_no_api_used) or []
+            seconds = timeit(find_path, repeat)
+            report('find_path {} apis ({} endpoints, {} paths)'.format(max_no_api_used, n_endpoints, len(paths)), seconds, 1, 'query')
+
+
+'''
+mock registry holding about n_endpoints endpoints, 10 per api
+'''
+def mock_registry(n_endpoints, **kwargs):
+    return MockRegistry(n_apis=max(1, n_endpoints // 10), endpoints_per_api=min(10, n_endpoints),
+                        n_types=max(3, int(n_endpoints ** 0.5)), latency=MOCK_LATENCY, **kwargs)
+
+
+'''
+pathViewer building the graph and its node and edge payloads without rendering them,
+visJS2jupyter fetches vis.js from a cdn when imported, which an offline benchmark can't rely on
+'''
+def headless_viewer(api_handler):
+    from BioThingsExplorer import pathViewer
+    class HeadlessViewer(pathViewer):
+        def color_nodes(self, G, field_to_map):
+            return {_node: 'gray' for _node in G}
+
+        def render(self, nodes_dict, edges_dict, edge_font_size, edge_font_align):
+            return (nodes_dict, edges_dict)
+    return HeadlessViewer(api_handler=api_handler)
+
+
+def mock_viewer(mock):
+    viewer = headless_viewer(SmartAPIHandler(cache_dir=None, registry_url=mock.registry_url))
+    viewer.show_api_road_map(display_graph=False)
+    return viewer
+
+
+'''
+first chain of n_hops hops found in the registry of api_handler, in the format of pathViewer.path_conversion
+'''
+def find_chain(api_handler, n_hops):
+    def extend(chain, seen):
+        if len(chain) == n_hops:
+            return chain
+        for _output, _endpoints in sorted(api_handler.endpoint_index.get(seen[-1], {}).items()):
+            if _output not in seen:
+                found = extend(chain + [{'input': api_handler.name_of_uri[seen[-1]], 'endpoint': _endpoints[0],
+                                         'output': api_handler.name_of_uri[_output]}], seen + [_output])
+                if found:
+                    return found
+    for _input in sorted(api_handler.endpoint_index):
+        found = extend([], [_input])
+        if found:
+            return found
+    raise ValueError('no chain of {} hops in the registry'.format(n_hops))
+
+
+'''
+SmartAPIHandler start-up against the mock registry, from scratch and from the local snapshot
+'''
+def bench_startup(sizes, repeat):
+    for n_endpoints in sizes:
+        with mock_registry(n_endpoints) as mock:
+            report('startup from registry ({} endpoints)'.format(n_endpoints),
+                   timeit(lambda: SmartAPIHandler(cache_dir=None, registry_url=mock.registry_url), repeat), 1, 'start')
+            with tempfile.TemporaryDirectory() as cache_dir:
+                SmartAPIHandler(cache_dir=cache_dir, registry_url=mock.registry_url)
+                report('startup from snapshot ({} endpoints)'.format(n_endpoints),
+                       timeit(lambda: SmartAPIHandler(cache_dir=cache_dir, registry_url=mock.registry_url), repeat), 1, 'start')
+
+
+'''
+single-hop and multi-hop find_output for growing numbers of start values, with an empty and a warm response cache
+'''
+def bench_find_output(sizes, repeat):
+    with mock_registry(50) as mock:
+        viewer = mock_viewer(mock)
+        for n_hops in (1, 3):
+            path = find_chain(viewer.api_handler, n_hops)
+            for n_values in sizes:
+                values = [str(i) for i in range(n_values)]
+                def find_output():
+                    viewer.api_handler.response_cache.clear()
+                    viewer.find_output(path, values, display_graph=False)
+                report('find_output {} hops ({} values)'.format(n_hops, n_values), timeit(find_output, repeat), n_values, 'value')
+                report('find_output {} hops cached ({} values)'.format(n_hops, n_values),
+                       timeit(lambda: viewer.find_output(path, values, display_graph=False), repeat), n_values, 'value')
+
+
+'''
+explore_all_paths over the paths of up to 3 apis between two types, including the graph built by draw_graph
+'''
+def bench_explore_all_paths(sizes, repeat, max_paths=5):
+    with mock_registry(50) as mock:
+        viewer = mock_viewer(mock)
+        path = find_chain(viewer.api_handler, 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            paths = viewer.find_path(path[0]['input'], path[-1]['output'], display_graph=False, max_no_api_used=3)
+        viewer.paths = paths[:max_paths]
+        for n_values in sizes:
+            values = [str(i) for i in range(n_values)]
+            def explore_all_paths():
+                viewer.api_handler.response_cache.clear()
+                viewer.explore_all_paths(values)
+            report('explore_all_paths {} paths ({} values)'.format(len(viewer.paths), n_values),
+                   timeit(explore_all_paths, repeat), n_values, 'value')
+
+
+'''
+draw_graph of random result graphs with n_edges edges, hubs included, up to the payloads handed to visjs
+'''
+def bench_draw_graph(sizes, repeat):
+    viewer = headless_viewer(SyntheticRegistry(10))
+    for n_edges in sizes:
+        rng = random.Random(0)
+        n_inputs = max(1, n_edges // 20)
+        edges = list(dict.fromkeys(('Gene:{}'.format(rng.randrange(n_inputs)), 'Variant:{}'.format(rng.randrange(n_edges)))
+                                   for _ in range(n_edges)))
+        nodes = list(dict.fromkeys(_node for _edge in edges for _node in _edge))
+        def draw_graph():
+            # measure rendering, not the metric cache
+            viewer.metric_cache.clear()
+            viewer.draw_graph(nodes, edges)
+        report('draw_graph ({} edges)'.format(len(edges)), timeit(draw_graph, repeat), 1, 'graph')
+
+
+BENCHMARKS = {'jsonld2nquads': bench_jsonld2nquads, 'extractor': bench_extractor, 'startup': bench_startup,
+              'find_path': bench_find_path, 'find_output': bench_find_output, 'explore_all_paths': bench_explore_all_paths,
+              'draw_graph': bench_draw_graph}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run offline benchmarks')
+    parser.add_argument('benchmarks', nargs='*', default=list(BENCHMARKS), help=', '.join(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=MOCK_LATENCY, help='seconds added to every api call of the mock registry')
+    args = parser.parse_args()
+    MOCK_LATENCY = args.latency
+    for _name in args.benchmarks:
+        if _name not in BENCHMARKS:
+            parser.error('unknown benchmark: {}'.format(_name))
+    for _name in args.benchmarks:
+        BENCHMARKS[_name](args.sizes, args.repeat)
@@ -0,0 +1,179 @@
+'''
+Headless entry point, run path queries for a file of start ids and stream the records to JSONL or Parquet
+run with: python cli.py ids.txt --path "Gene -> http://mygene.info/v3/query -> Variant" -o results.jsonl
+      or: python cli.py ids.txt --from Gene --to Drug --max-apis 2 -o results.parquet
+'''
+import argparse
+import contextlib
+import io
+import json
+import sys
+
+from api_handler import SmartAPIHandler, DEFAULT_CACHE_DIR, REGISTRY_URL_PREFIX
+from BioThingsExplorer import pathViewer
+
+COLUMNS = ['path', 'start_value', 'hop', 'input_type', 'input_id', 'endpoint', 'output_type', 'output_id', 'relation']
+
+
+'''
+start ids of a text file, one per line, blank lines and lines starting with # are skipped
+'''
+def read_ids(path):
+    with (path == '-' and contextlib.nullcontext(sys.stdin) or open(path)) as f:
+        for _line in f:
+            _line = _line.strip()
+            if _line and not _line.startswith('#'):
+                yield _line
+
+
+'''
+parse a path as printed by find_path, e.g. "Gene -> http://mygene.info/v3/query -> Variant"
+return its hops in the format of pathViewer.path_conversion
+'''
+def parse_path(spec, api_handler):
+    steps = [_step.strip() for _step in spec.split('->')]
+    if len(steps) < 3 or len(steps) % 2 == 0:
+        raise ValueError('a path alternates types and endpoints, starting and ending with a type: {}'.format(spec))
+    for _type in steps[::2]:
+        if _type not in api_handler.uri_of_name:
+            raise ValueError('unknown type {}'.format(_type))
+    hops = []
+    for i in range(0, len(steps) - 2, 2):
+        (_input, _endpoint, _output) = steps[i:i + 3]
+        if _endpoint not in api_handler.api_endpoint_locator(api_handler.uri_of_name[_input], api_handler.uri_of_name[_output]):
+            raise ValueError('{} does not take {} to {}'.format(_endpoint, _input, _output))
+        hops.append({'input': _input, 'endpoint': _endpoint, 'output': _output})
+    return hops
+
+
+'''
+group an iterable into lists of at most size items
+'''
+def chunks(items, size):
+    chunk = []
+    for _item in items:
+        chunk.append(_item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+'''
+yield one row per record of every path, for every chunk of start ids
+final_only: only keep the records of the last hop of each path
+'''
+def run(viewer, paths, ids, chunk_size=1000, batch=True, final_only=False):
+    for _chunk in chunks(ids, chunk_size):
+        for _name, _path in paths:
+            for (_start, _hop, _input, _output, _relation) in viewer.iter_output(_path, _chunk, batch=batch):
+                if final_only and _hop != len(_path) - 1:
+                    continue
+                yield {'path': _name, 'start_value': _start, 'hop': _hop, 'input_type': _path[_hop]['input'], 'input_id': _input,
+                       'endpoint': _path[_hop]['endpoint'], 'output_type': _path[_hop]['output'], 'output_id': _output,
+                       'relation': _relation}
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.file = path == '-' and sys.stdout or open(path, 'w')
+
+    def write(self, rows):
+        for _row in rows:
+            self.file.write(json.dumps(_row, default=str) + '\n')
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class ParquetWriter:
+    '''
+    write rows as parquet row groups of row_group_size rows, so memory stays bounded whatever the number of ids
+    object outputs (json documents) are stored as json strings
+    '''
+    def __init__(self, path, row_group_size=100000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([(_column, _column == 'hop' and pa.int8() or pa.string()) for _column in COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+
+    def write(self, rows):
+        for _chunk in chunks(rows, self.row_group_size):
+            columns = {_column: [] for _column in COLUMNS}
+            for _row in _chunk:
+                for _column in COLUMNS:
+                    _value = _row[_column]
+                    if _column != 'hop' and _value is not None and not isinstance(_value, str):
+                        _value = json.dumps(_value, sort_keys=True, default=str)
+                    columns[_column].append(_value)
+            self.writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='run path queries for a file of start ids, without jupyter')
+    parser.add_argument('ids', help='file of start ids, one per line, - for stdin')
+    parser.add_argument('--path', action='append', default=[], help='path to run, e.g. "Gene -> <endpoint> -> Variant", may be repeated')
+    parser.add_argument('--from', dest='start', help='run every path from this type, together with --to')
+    parser.add_argument('--to', dest='end', help='run every path to this type, together with --from')
+    parser.add_argument('--max-apis', type=int, default=2, help='longest path run with --from/--to, in number of apis')
+    parser.add_argument('-o', '--output', default='-', help='.jsonl or .parquet file, - for jsonl on stdout')
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], help='output format, guessed from the output file name by default')
+    parser.add_argument('--final-only', action='store_true', help='only write the outputs of the last hop of each path')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='start ids run together')
+    parser.add_argument('--no-batch', action='store_true', help='query start ids one by one instead of batch post requests')
+    parser.add_argument('--registry-url', default=REGISTRY_URL_PREFIX)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--offline', action='store_true', help='only use the local registry snapshot')
+    parser.add_argument('--processes', type=int, default=0, help='worker processes for response processing')
+    args = parser.parse_args(argv)
+    if not args.path and not (args.start and args.end):
+        parser.error('give either --path or both --from and --to')
+    output_format = args.format or (args.output.endswith('.parquet') and 'parquet' or 'jsonl')
+    if output_format == 'parquet':
+        if args.output == '-':
+            parser.error('parquet needs an output file')
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error('parquet output needs pyarrow')
+
+    api_handler = SmartAPIHandler(cache_dir=args.cache_dir, offline=args.offline, registry_url=args.registry_url,
+                                  processes=args.processes)
+    viewer = pathViewer(api_handler=api_handler)
+    try:
+        paths = [parse_path(_spec, api_handler) for _spec in args.path]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.start and args.end:
+        viewer.show_api_road_map(display_graph=False)
+        # find_path lists the paths it finds, keep stdout for the records
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = viewer.find_path(args.start, args.end, display_graph=False, max_no_api_used=args.max_apis) or []
+        paths += [viewer.path_conversion(_path) for _path in found]
+    if not paths:
+        parser.error('no path found from {} to {}'.format(args.start, args.end))
+    named_paths = [('path' + str(i), _path) for i, _path in enumerate(paths)]
+    for _name, _path in named_paths:
+        print('{}: {}'.format(_name, ' -> '.join([_path[0]['input']] + [_step for _hop in _path for _step in (_hop['endpoint'], _hop['output'])])),
+              file=sys.stderr)
+
+    writer = output_format == 'parquet' and ParquetWriter(args.output) or JsonlWriter(args.output)
+    try:
+        writer.write(run(viewer, named_paths, read_ids(args.ids), args.chunk_size, not args.no_batch, args.final_only))
+    finally:
+        writer.close()
+        if api_handler.pool:
+            api_handler.pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import re
+import sys
+import threading
+
+
+class IdResolver:
+    '''
+    normalize the ids passed between hops, so equivalent ids share their api calls and cache entries
+    ids are canonicalized once per bioentity uri with the identifier_pattern of the id mapping:
+    surrounding whitespace is dropped, and a curie prefix (registry identifier, preferred name or the uri itself)
+    is stripped when the id only matches the pattern without it, e.g. "HGNC:1097" -> "1097"
+
+    strict: ids still not matching their pattern are left out instead of queried
+    '''
+    def __init__(self, bioentity_info=None, strict=False):
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.stats = {'normalized': 0, 'invalid': 0}
+        self.update(bioentity_info or {})
+
+    '''
+    compile the identifier patterns and prefixes of every bioentity uri
+    a pattern which is missing (NaN in the id mapping) or not a valid regex validates nothing
+    '''
+    def update(self, bioentity_info):
+        self.patterns = {}
+        self.prefixes = {}
+        for _uri, _info in bioentity_info.items():
+            _pattern = _info.get('identifier_pattern')
+            if isinstance(_pattern, str) and _pattern:
+                try:
+                    self.patterns[_uri] = re.compile(_pattern)
+                except re.error:
+                    print('ignoring the invalid identifier pattern of {}: {}'.format(_uri, _pattern), file=sys.stderr)
+            self.prefixes[_uri] = [_prefix.lower() + ':' for _prefix in (_info.get('registry_identifier'), _info.get('preferred_name'))
+                                   if isinstance(_prefix, str) and _prefix]
+
+    def matches(self, uri, value):
+        return uri not in self.patterns or self.patterns[uri].search(value) is not None
+
+    '''
+    canonical form of value as an id of uri, None if it doesn't match the identifier pattern of uri in strict mode
+    '''
+    def normalize(self, uri, value):
+        value = str(value).strip()
+        if self.matches(uri, value):
+            return value
+        for _prefix in self.prefixes.get(uri, []) + [uri]:
+            if value.lower().startswith(_prefix.lower()) and self.matches(uri, value[len(_prefix):]):
+                with self.lock:
+                    self.stats['normalized'] += 1
+                return value[len(_prefix):]
+        with self.lock:
+            self.stats['invalid'] += 1
+        return None if self.strict else value
@@ -0,0 +1,111 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Profiler:
+    '''
+    timing spans and counters for api calls, hops and processing stages
+    every measure is indexed by its name and an optional label, usually the endpoint
+    hooks are called as hook(kind, name, label, value) for every measure, kind being 'timing' or 'count',
+    e.g. to forward measures to statsd or prometheus
+    report hooks are called with the whole report each time publish is called, i.e. after each exploration
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.hooks = []
+        self.report_hooks = []
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timings = {}
+            self.started = time.time()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def add_report_hook(self, hook):
+        self.report_hooks.append(hook)
+
+    def count(self, name, value=1, label=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[(name, label)] = self.counters.get((name, label), 0) + value
+        for _hook in self.hooks:
+            _hook('count', name, label, value)
+
+    def timing(self, name, seconds, label=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            if (name, label) not in self.timings:
+                self.timings[(name, label)] = {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds,
+                                               'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+            stats = self.timings[(name, label)]
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['min'] = min(stats['min'], seconds)
+            stats['max'] = max(stats['max'], seconds)
+            stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        for _hook in self.hooks:
+            _hook('timing', name, label, seconds)
+
+    '''
+    time the enclosed block, e.g. with profiler.span('api_call', endpoint): ...
+    '''
+    @contextmanager
+    def span(self, name, label=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(name, time.perf_counter() - start, label)
+
+    '''
+    structured summary of everything measured since the last reset
+    {'elapsed': seconds, 'counters': {name: {label: value}}, 'timings': {name: {label: stats}}}
+    '''
+    def report(self):
+        with self.lock:
+            counters = {}
+            for (_name, _label), _value in self.counters.items():
+                counters.setdefault(_name, {})[_label] = _value
+            timings = {}
+            for (_name, _label), _stats in self.timings.items():
+                timings.setdefault(_name, {})[_label] = {
+                    'count': _stats['count'], 'total': _stats['total'], 'mean': _stats['total'] / _stats['count'],
+                    'min': _stats['min'], 'max': _stats['max'],
+                    'histogram': dict(zip([str(_bound) for _bound in LATENCY_BUCKETS] + ['inf'], _stats['buckets']))}
+            return {'elapsed': time.time() - self.started, 'counters': counters, 'timings': timings}
+
+    '''
+    hand the current report to every report hook, and return it
+    '''
+    def publish(self):
+        report = self.report()
+        for _hook in self.report_hooks:
+            _hook(report)
+        return report
+
+    '''
+    human readable version of report, one line per measure
+    '''
+    def summary(self):
+        report = self.report()
+        lines = ['elapsed: {:.3f}s'.format(report['elapsed'])]
+        for _name, _labels in sorted(report['timings'].items()):
+            for _label, _stats in _labels.items():
+                lines.append('{} {}: {} calls, {:.3f}s total, {:.1f}ms mean, {:.1f}ms max'.format(
+                    _name, _label or '', _stats['count'], _stats['total'], _stats['mean'] * 1000, _stats['max'] * 1000))
+        for _name, _labels in sorted(report['counters'].items()):
+            for _label, _value in _labels.items():
+                lines.append('{} {}: {}'.format(_name, _label or '', _value))
+        return '\n'.join(lines)
@@ -1,26 +1,64 @@
 from pyld import jsonld
 import json
 import re
-import requests
+from urllib.parse import urljoin
+
+from transport import get_default_transport
 
 t = jsonld.JsonLdProcessor()
 
+NQUADS_SERVICE_URL = 'http://jsonld.biothings.io/?action=nquads'
+
+# jsonld context documents indexed by their url, served to pyld by load_document
+# pyld keeps the processed version of each url-referenced context in its own cache,
+# so a context is only compiled once per endpoint instead of once per response
+context_documents = {}
+
 '''
-Input: jsonld document
+make a jsonld context available locally under its url
+'''
+def register_context(context_url, context_doc):
+	context_documents[context_url] = context_doc
+
+'''
+forget a registered context, e.g. because it changed upstream
+pyld's cache of processed contexts is cleared too, so the new version gets used
+'''
+def unregister_context(context_url):
+	context_documents.pop(context_url, None)
+	if hasattr(jsonld, '_resolved_context_cache'):
+		jsonld._resolved_context_cache.clear()
+
+'''
+pyld document loader, resolve registered contexts without any network access
+anything else is fetched through the shared transport, and registered for next time
+'''
+def load_document(url, options={}):
+	if url not in context_documents:
+		response = get_default_transport().get(url, headers={'Accept': 'application/ld+json, application/json'})
+		if response.status_code != 200:
+			raise jsonld.JsonLdError('Could not retrieve a JSON-LD document from the URL.', 'jsonld.LoadDocumentError',
+				{'url': url, 'status': response.status_code}, code='loading document failed')
+		register_context(url, response.json())
+	return {'contextUrl': None, 'documentUrl': url, 'document': context_documents[url]}
+
+'''
+Input: jsonld document, optionally the url of a registered context to apply
 Output: nquads format of the jsonld doc
 '''
-def jsonld2nquads(jsonld_doc):
-	'''
-	cmd = 'jsonld --validate --format nquads'
-	p = Popen(cmd.split(), shell=True, stdout=PIPE, stdin=PIPE, stderr=STDOUT)
-	p.stdin.write(json.dumps(jsonld_doc).encode())
-	stdout_data = p.communicate()[0]
-	p.stdin.close()
-	data_output = stdout_data.decode()
-	print(data_output)
-	'''
+def jsonld2nquads(jsonld_doc, context_url=None):
+	if context_url:
+		jsonld_doc = dict(jsonld_doc, **{'@context': context_url})
+	return jsonld.to_rdf(jsonld_doc, {'documentLoader': load_document})
+
+'''
+Input: jsonld document
+Output: nquads format of the jsonld doc, converted by the remote jsonld service
+kept as a reference implementation for benchmarking against jsonld2nquads
+'''
+def jsonld2nquads_remote(jsonld_doc, service_url=NQUADS_SERVICE_URL):
 	# need to skip html escapes
-	nquads = requests.post('http://jsonld.biothings.io/?action=nquads', data={'doc':json.dumps(jsonld_doc).replace('>', "&gt;").replace(' ','')})
+	nquads = get_default_transport().post(service_url, data={'doc':json.dumps(jsonld_doc).replace('>', "&gt;").replace(' ','')})
 	# remove the log line from the nquads
 	nquads = re.sub('Parsed .*second.\n', '', nquads.json()['output'])
 	return t.parse_nquads(nquads)
@@ -39,4 +77,175 @@ def fetchvalue(nquads, object_uri, predicate='http://www.w3.org/2004/02/skos/cor
 	if results:
 		return list(set(results))
 	else:
-		return [None]
\ No newline at end of file
+		return [None]
+'''
+compiled form of a jsonld context
+pull (object, predicate) pairs straight out of a json document, without expanding it to nquads
+'''
+class ContextExtractor:
+	def __init__(self, context_doc):
+		context = context_doc.get('@context', context_doc)
+		# string valued terms also act as prefixes for compact iris, e.g. "ont": "http://..."
+		self.prefixes = {k: v for k, v in context.items() if isinstance(v, str) and not k.startswith('@') and v != '@id'}
+		self.vocab = context.get('@vocab')
+		# term definitions of each context, indexed by context
+		self.definitions = {}
+		# every distinct set of terms in scope, indexed by its content, so a scope re-entered through nesting is the same object
+		self.interned = {}
+		self.terms = self.compile_terms(context, {})
+		# scoped contexts are compiled the first time they are met, indexed by (term, enclosing terms)
+		self.scoped_terms = {}
+		# whether the terms in scope can lead to a given object uri from a base, indexed by (terms, base, object uri)
+		self.reachable = {}
+		# keys aliased to @id, indexed by terms
+		self.aliases = {}
+
+	'''
+	expand a compact iri using the prefixes of the context, resolve relative iris against base
+	'''
+	def expand_iri(self, value, base=None):
+		if ':' in value:
+			prefix, suffix = value.split(':', 1)
+			if prefix in self.prefixes and not suffix.startswith('//'):
+				return self.prefixes[prefix] + suffix
+			return value
+		if base:
+			# plain identifiers just replace the last path segment of base, skip the full rfc3986 resolution
+			if base.endswith('/') and not any(_c in value for _c in '/?#') and value not in ('', '.', '..'):
+				return base + value
+			return urljoin(base, value)
+		return None
+
+	'''
+	turn the term definitions of a (scoped) context into {term: {'predicate', 'base', 'type_id', 'context'}}
+	terms inherited from the enclosing context included
+	'''
+	def compile_terms(self, context, parent_terms):
+		if id(context) not in self.definitions:
+			definitions = {}
+			for _term, _definition in context.items():
+				if _term.startswith('@'):
+					continue
+				if _definition == '@id':
+					definitions[_term] = {'alias': '@id'}
+				elif isinstance(_definition, str):
+					definitions[_term] = {'predicate': self.expand_iri(_definition), 'base': None, 'type_id': False, 'context': None}
+				elif isinstance(_definition, dict):
+					scoped = _definition.get('@context')
+					definitions[_term] = {'predicate': self.expand_iri(_definition.get('@id', _term)), 'type_id': _definition.get('@type') == '@id',
+					                      'base': scoped.get('@base') if scoped else None, 'context': scoped}
+			self.definitions[id(context)] = (context, definitions)
+		terms = dict(parent_terms)
+		terms.update(self.definitions[id(context)][1])
+		return self.interned.setdefault(frozenset((_term, id(_info)) for _term, _info in terms.items()), terms)
+
+	def terms_in_scope(self, info, terms):
+		if not info['context']:
+			return terms
+		key = (id(info), id(terms))
+		if key not in self.scoped_terms:
+			self.scoped_terms[key] = (info, terms, self.compile_terms(info['context'], terms))
+		return self.scoped_terms[key][2]
+
+	def id_aliases(self, terms):
+		if id(terms) not in self.aliases:
+			self.aliases[id(terms)] = (terms, [_k for _k, _v in terms.items() if 'alias' in _v])
+		return self.aliases[id(terms)][1]
+
+	'''
+	whether any value under a term, met where terms are in scope and base applies, could expand to an iri containing object_uri
+	a term without a scoped context keeps the enclosing terms and base, so it reaches whatever they reach
+	'''
+	def can_reach(self, info, terms, base, object_uri):
+		value_base = info['base'] or base
+		if value_base and object_uri in value_base:
+			return True
+		return self.scope_reaches(self.terms_in_scope(info, terms), value_base, object_uri)
+
+	'''
+	whether any term of terms could lead to object_uri from base
+	a search cut short by a cycle may miss a way out of the cycle, so negative answers are only kept for the search root
+	'''
+	def scope_reaches(self, terms, base, object_uri, visiting=None):
+		key = (id(terms), base, object_uri)
+		if key in self.reachable:
+			return self.reachable[key][1]
+		root = visiting is None
+		visiting = visiting if visiting is not None else set()
+		if key in visiting:
+			return False
+		visiting.add(key)
+		found = False
+		for _info in terms.values():
+			if 'alias' in _info or not _info['predicate']:
+				continue
+			value_base = _info['base'] or base
+			if (value_base and object_uri in value_base) or self.scope_reaches(self.terms_in_scope(_info, terms), value_base, object_uri, visiting):
+				found = True
+				break
+		visiting.discard(key)
+		if found or root:
+			# terms is kept alongside, so its id is never reused while the entry lives
+			self.reachable[key] = (terms, found)
+		return found
+
+	'''
+	walk json_doc following the compiled terms, yield (object, predicate) pairs
+	'''
+	def walk(self, json_doc, terms, base, object_uri):
+		for _key, _value in json_doc.items():
+			if _key in terms:
+				_info = terms[_key]
+			elif self.vocab and not _key.startswith('@'):
+				_info = {'predicate': self.vocab + _key, 'base': None, 'type_id': False, 'context': None}
+			else:
+				# keys which are not jsonld terms are dropped during expansion, along with everything below them
+				continue
+			if 'alias' in _info or not _info['predicate']:
+				continue
+			if object_uri and not self.can_reach(_info, terms, base, object_uri):
+				continue
+			value_base = _info['base'] or base
+			value_terms = self.terms_in_scope(_info, terms)
+			for _item in (_value if isinstance(_value, list) else [_value]):
+				if isinstance(_item, str):
+					if _info['type_id']:
+						_item = self.expand_iri(_item, value_base)
+					if _item:
+						yield (_item, _info['predicate'])
+				elif isinstance(_item, dict):
+					node_id = [_item[_k] for _k in self.id_aliases(value_terms) if _k in _item] or [_item.get('@id')]
+					if isinstance(node_id[0], str):
+						node_id = self.expand_iri(node_id[0], value_base)
+						if node_id:
+							yield (node_id, _info['predicate'])
+					yield from self.walk(_item, value_terms, value_base, object_uri)
+
+	'''
+	same result format as fetchvalue(jsonld2nquads(json_doc), object_uri)
+	'''
+	def extract(self, json_doc, object_uri):
+		results = set()
+		# compact iris or a vocab could map any value onto object_uri, only prune the walk when neither is possible
+		prune_for = object_uri
+		if self.vocab or any(object_uri in _prefix for _prefix in self.prefixes.values()):
+			prune_for = None
+		for _doc in (json_doc if isinstance(json_doc, list) else [json_doc]):
+			for (_object, _predicate) in self.walk(_doc, self.terms, None, prune_for):
+				if object_uri in _object:
+					results.add((_object.split(object_uri)[1], _predicate.split('/')[-1]))
+		if results:
+			return list(results)
+		else:
+			return [None]
+
+'''
+compare the compiled extractor against the nquads path for one document
+return (values only found by the extractor, values only found through nquads)
+'''
+def check_conformance(json_doc, context_url, object_uri, extractor=None):
+	if not extractor:
+		extractor = ContextExtractor(context_documents[context_url])
+	compiled = set(extractor.extract(json_doc, object_uri))
+	reference = set(fetchvalue(jsonld2nquads(json_doc, context_url), object_uri))
+	return (compiled - reference, reference - compiled)
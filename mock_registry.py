@@ -0,0 +1,208 @@
+'''
+Local stand-in for the SmartAPI registry and the BioThings apis it describes
+serve it with MockRegistry(...).start(), then point SmartAPIHandler(registry_url=mock.registry_url) at it
+'''
+import csv
+import io
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import yaml
+
+ONTOLOGY = 'http://biothings.io/explorer/vocab/ontology/'
+
+
+class MockRegistry:
+    '''
+    synthetic registry of n_apis apis with endpoints_per_api endpoints each, over n_types bioentity types
+    every endpoint takes one type and returns one to three others, served over http together with
+    API_LIST.yml, the openapi files, ID_MAPPING.csv and the jsonld context of every endpoint
+
+    hits: number of output ids returned for each output type of an api call
+    id_space: output ids are drawn from range(id_space), a small id_space makes paths converge
+    latency: seconds added to every api call, or a function returning them, e.g. lambda: random.expovariate(50)
+    registry_latency: same as latency, for registry files and jsonld contexts
+    recordings: recorded hits served instead of synthetic ones, {endpoint path, e.g. '/api0/query1': {value: hit}}
+    seed: seed of the random registry layout, api responses only depend on the endpoint and the value
+    '''
+    def __init__(self, n_apis=5, endpoints_per_api=4, n_types=6, hits=3, id_space=1000, latency=0,
+                 registry_latency=0, recordings=None, seed=0):
+        self.n_apis = n_apis
+        self.endpoints_per_api = endpoints_per_api
+        self.n_types = n_types
+        self.hits = hits
+        self.id_space = id_space
+        self.latency = latency
+        self.registry_latency = registry_latency
+        self.recordings = recordings or {}
+        self.seed = seed
+        self.server = None
+        # number of requests served, indexed by 'registry' and 'api'
+        self.requests = {'registry': 0, 'api': 0}
+        self.lock = threading.Lock()
+
+    @property
+    def registry_url(self):
+        return self.url + 'registry/'
+
+    '''
+    serve the registry on a free local port in a background thread
+    '''
+    def start(self):
+        self.server = MockServer(('127.0.0.1', 0), MockHandler)
+        self.server.registry = self
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.build()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    '''
+    load recorded responses from a json file, in the format of recordings
+    '''
+    def load_recordings(self, path):
+        with open(path) as f:
+            for _endpoint, _responses in json.load(f).items():
+                self.recordings.setdefault(_endpoint, {}).update(_responses)
+
+    def type_uri(self, i):
+        return 'http://identifiers.org/type{}/'.format(i)
+
+    '''
+    generate every registry file, indexed by url path
+    '''
+    def build(self):
+        rng = random.Random(self.seed)
+        self.files = {}
+        # outputs of each endpoint, as (field, output uri), indexed by endpoint path
+        self.endpoints = {}
+        uris = [self.type_uri(i) for i in range(self.n_types)]
+        mapping = io.StringIO()
+        writer = csv.writer(mapping)
+        writer.writerow(['URI', 'Preferred Name', 'Registry Identifier', 'Alternative Names', 'Description', 'Identifier Pattern', 'Type'])
+        for i, _uri in enumerate(uris):
+            writer.writerow([_uri, 'Type{}'.format(i), 'type{}'.format(i), '', 'synthetic type {}'.format(i), r'^\d+$', 'Entity'])
+        self.files['/registry/ID_MAPPING.csv'] = mapping.getvalue().encode()
+        api_list = []
+        for i in range(self.n_apis):
+            server = self.url + 'api{}'.format(i)
+            paths = {}
+            for j in range(self.endpoints_per_api):
+                name = '/query{}'.format(j)
+                _input = rng.choice(uris)
+                _outputs = rng.sample([_uri for _uri in uris if _uri != _input], min(rng.randint(1, 3), len(uris) - 1))
+                fields = [('type{}'.format(uris.index(_output)), _output) for _output in _outputs]
+                self.endpoints['/api{}{}'.format(i, name)] = fields
+                context_path = '/context/api{}/query{}.jsonld'.format(i, j)
+                self.files[context_path] = json.dumps({'@context': {
+                    'ont': ONTOLOGY,
+                    'hits': {'@id': 'ont:hits', '@context': {
+                        _field: {'@id': 'ont:' + _field + '_of', '@type': '@id', '@context': {'@base': _output}}
+                        for (_field, _output) in fields}}}}).encode()
+                parameter = {'name': 'q', 'required': True, 'x-valueType': [_input],
+                             'x-requestTemplate': [{'valueType': 'default', 'template': '{{input}}'}]}
+                responses = {'200': {'x-responseValueType': [{'path': 'hits.' + _field, 'valueType': _output} for (_field, _output) in fields],
+                                     'x-JSONLDContext': self.url + context_path[1:]}}
+                paths[name] = {'get': {'parameters': [dict(parameter, **{'in': 'query'})], 'responses': responses},
+                               'post': {'parameters': [dict(parameter, **{'in': 'body'})], 'responses': responses}}
+            openapi = {'openapi': '3.0.0', 'info': {'title': 'API{}'.format(i), 'version': '1.0'},
+                       'servers': [{'url': server}], 'paths': paths}
+            self.files['/registry/openapi/api{}.yml'.format(i)] = yaml.safe_dump(openapi).encode()
+            api_list.append({'name': 'API{}'.format(i), 'metadata': 'openapi/api{}.yml'.format(i)})
+        self.files['/registry/API_LIST.yml'] = yaml.safe_dump({'APIs': api_list}).encode()
+        self.etags = {_path: '"{:x}"'.format(zlib.crc32(_content)) for _path, _content in self.files.items()}
+
+    '''
+    the hit of endpoint for value, recorded or synthetic
+    synthetic ids only depend on the endpoint, the value and the output, so results are reproducible
+    '''
+    def hit(self, endpoint, value):
+        if value in self.recordings.get(endpoint, {}):
+            return dict(self.recordings[endpoint][value], query=value)
+        hit = {'_id': value, 'query': value}
+        for (_field, _output) in self.endpoints[endpoint]:
+            seed = zlib.crc32('{} {} {}'.format(endpoint, value, _field).encode())
+            hit[_field] = [str(_id) for _id in random.Random(seed).sample(range(self.id_space), min(self.hits, self.id_space))]
+        return hit
+
+    def wait(self, latency):
+        seconds = latency() if callable(latency) else latency
+        if seconds:
+            time.sleep(seconds)
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] += 1
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # api calls open a new connection each, the default backlog of 5 stalls bursts of them for a whole second
+    request_queue_size = 128
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    '''
+    answer registry file requests, get queries with one value and post queries with comma separated values
+    '''
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, keep-alive clients would wait for delayed acks otherwise
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        registry = self.server.registry
+        url = urlparse(self.path)
+        if url.path in registry.files:
+            registry.count('registry')
+            registry.wait(registry.registry_latency)
+            if self.headers.get('If-None-Match') == registry.etags[url.path]:
+                return self.reply(304, b'')
+            return self.reply(200, registry.files[url.path], {'ETag': registry.etags[url.path]})
+        if url.path in registry.endpoints:
+            value = parse_qs(url.query).get('q', [''])[0]
+            return self.answer(url.path, [value], False)
+        self.reply(404, b'')
+
+    def do_POST(self):
+        registry = self.server.registry
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        if url.path in registry.endpoints:
+            values = parse_qs(body).get('q', [''])[0].split(',')
+            return self.answer(url.path, values, True)
+        self.reply(404, b'')
+
+    def answer(self, endpoint, values, batch):
+        registry = self.server.registry
+        registry.count('api')
+        registry.wait(registry.latency)
+        hits = [registry.hit(endpoint, _value) for _value in values]
+        # post queries return a list of hits, get queries a document holding them
+        self.reply(200, json.dumps(hits if batch else {'hits': hits}).encode(), {'Content-Type': 'application/json'})
+
+    def reply(self, status, payload, headers={}):
+        self.send_response(status)
+        for _name, _value in headers.items():
+            self.send_header(_name, _value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,197 @@
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from transport import CircuitOpenError
+
+
+class PathExecutor:
+    '''
+    asyncio based engine running several paths for several start values at once
+    the outputs of each hop are sent on to the next hop as soon as they arrive
+    inputs waiting for the same hop are sent together, as batch queries of at most the batch size of the endpoint
+
+    path_handler: function(hop, value, batch) returning the responses of one api call, e.g. pathViewer.path_handler
+    api_handler: SmartAPIHandler, used to group endpoints by api for max_per_api and to skip degraded apis
+    max_concurrency: number of api calls in flight overall
+    max_per_api: number of api calls in flight against a single api
+    timeout: seconds after which the executor stops waiting for an api call, None to wait as long as the transport
+        of api_handler keeps retrying, which already bounds every request with its own timeout and retries
+    max_calls: number of api requests after which no new path is started, None for no limit
+        paths already started always run to the end, so the requests they still need may overrun it
+    linger: seconds an input waits for more inputs of the same hop before their batch is sent
+
+    the responses of every api call are kept for the lifetime of the executor,
+    so paths run one after the other, e.g. by QueryPlanner steps, never repeat a hop they share
+    '''
+    def __init__(self, path_handler, api_handler, max_concurrency=16, max_per_api=4, timeout=None, max_calls=None, linger=0.01):
+        self.path_handler = path_handler
+        self.max_concurrency = max_concurrency
+        self.max_per_api = max_per_api
+        self.timeout = timeout
+        self.max_calls = max_calls
+        self.linger = linger
+        # responses of the api calls made so far, how many requests were sent and whether max_calls left paths out
+        self.completed = {}
+        self.sent = 0
+        self.exhausted = False
+        self.api_handler = api_handler
+        self.api_of = {}
+        for _api, _info in api_handler.api_info.items():
+            for _endpoint in _info['endpoints']:
+                self.api_of[_endpoint] = _api
+
+    '''
+    execute every path (a list of hops, as returned by pathViewer.path_conversion) for every start value
+    return one dict per path, holding the responses of each hop indexed by (hop index, input value),
+    or None for the paths not started because max_calls was spent
+    '''
+    def run(self, paths, values):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.execute(paths, values))
+        # an event loop is already running, e.g. inside jupyter, so use a loop of our own in another thread
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, self.execute(paths, values)).result()
+
+    '''
+    async generator yielding (path index, hop index, input value, responses) as soon as each api call returns
+    at most queue_size results wait for the consumer, api calls are held back while the queue is full
+    '''
+    async def stream(self, paths, values, queue_size=1000):
+        queue = asyncio.Queue(maxsize=queue_size)
+        task = asyncio.ensure_future(self.execute(paths, values, queue))
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+            await task
+        finally:
+            # the consumer may stop early, nothing is left to wait for then
+            task.cancel()
+
+    async def execute(self, paths, values, queue=None):
+        self.limit = asyncio.Semaphore(self.max_concurrency)
+        self.api_limits = {}
+        # identical api calls made by different paths or start values are only sent once
+        self.calls = {}
+        # (input value, future) of the inputs waiting for each hop, indexed by (endpoint, input, output)
+        self.pending = {}
+        # endpoints skipped because their api is degraded
+        self.skipped = set()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        results = [{} for _ in paths]
+        try:
+            walks = []
+            for i, _path in enumerate(paths):
+                # paths are only cut before their first hop, never after paying for part of them
+                if self.max_calls is not None and self.sent >= self.max_calls:
+                    self.exhausted = True
+                    results[i] = None
+                    continue
+                for _value in dict.fromkeys(values):
+                    results[i][(0, _value)] = []
+                    walks.append(self.walk(paths, i, 0, _value, results, queue))
+            await asyncio.gather(*walks)
+        finally:
+            self.executor.shutdown(wait=False)
+        if queue:
+            await queue.put(None)
+        return results
+
+    '''
+    run one hop of a path for one input, then every following hop for each of its outputs
+    '''
+    async def walk(self, paths, i, hop, value, results, queue=None):
+        response = await self.call(paths[i][hop], value)
+        results[i][(hop, value)] = response
+        if queue:
+            await queue.put((i, hop, value, response))
+        if hop + 1 < len(paths[i]):
+            walks = []
+            for _output in dict.fromkeys(_response[1] for _response in response):
+                # the same output may be reached from several inputs, only follow it once
+                if (hop + 1, _output) not in results[i]:
+                    results[i][(hop + 1, _output)] = []
+                    walks.append(self.walk(paths, i, hop + 1, _output, results, queue))
+            await asyncio.gather(*walks)
+
+    async def call(self, hop, value):
+        key = (hop['endpoint'], hop['input'], value, hop['output'])
+        if key in self.completed:
+            return self.completed[key]
+        if key not in self.calls:
+            self.calls[key] = self.enqueue(hop, value)
+        response = await self.calls[key]
+        self.completed[key] = response
+        return response
+
+    '''
+    queue value for hop, return a future of its responses
+    '''
+    def enqueue(self, hop, value):
+        group = (hop['endpoint'], hop['input'], hop['output'])
+        future = asyncio.get_running_loop().create_future()
+        if group not in self.pending:
+            self.pending[group] = []
+            asyncio.ensure_future(self.flush(hop, group))
+        self.pending[group].append((value, future))
+        return future
+
+    '''
+    send the inputs queued for hop in batches, and hand each input its own responses
+    '''
+    async def flush(self, hop, group):
+        # let the other walks reaching this hop queue their inputs first
+        await asyncio.sleep(self.linger)
+        queued = self.pending.pop(group)
+        batch_size = self.api_handler.batch_sizes.get(hop['endpoint'], self.api_handler.batch_size)
+        batches = [queued[i:i + batch_size] for i in range(0, len(queued), batch_size)]
+        await asyncio.gather(*[self.send(hop, _batch) for _batch in batches])
+
+    async def send(self, hop, batch):
+        responses = {_value: [] for (_value, _) in batch}
+        try:
+            found = await self.request(hop, list(responses))
+        except Exception as e:
+            # anything but a failed api call is a bug, raise it in every walk waiting for the batch
+            for (_, _future) in batch:
+                if not _future.done():
+                    _future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for (_, _future) in batch:
+                _future.cancel()
+            raise
+        for _response in found:
+            responses[_response[0]].append(_response)
+        for (_value, _future) in batch:
+            if not _future.done():
+                _future.set_result(responses[_value])
+
+    async def request(self, hop, values):
+        api = self.api_of.get(hop['endpoint'], hop['endpoint'])
+        if api not in self.api_limits:
+            self.api_limits[api] = asyncio.Semaphore(self.max_per_api)
+        loop = asyncio.get_running_loop()
+        # retries and backoff are left to the transport, retrying here too would send duplicate calls
+        try:
+            async with self.limit, self.api_limits[api]:
+                # a degraded api would only fail, leave it out of the exploration
+                if self.api_handler.is_degraded(hop['endpoint']):
+                    raise CircuitOpenError('{} is degraded'.format(api))
+                self.sent += self.api_handler.request_count(hop['endpoint'], len(values))
+                return await asyncio.wait_for(loop.run_in_executor(self.executor, self.path_handler, hop, values, True), self.timeout)
+        except CircuitOpenError as e:
+            if hop['endpoint'] not in self.skipped:
+                self.skipped.add(hop['endpoint'])
+                print('skipping {}: {}'.format(hop['endpoint'], e), file=sys.stderr)
+            return []
+        except (requests.exceptions.RequestException, asyncio.TimeoutError) as e:
+            print('giving up on {} for {} inputs: {!r}'.format(hop['endpoint'], len(values), e), file=sys.stderr)
+            return []
@@ -0,0 +1,97 @@
+import math
+
+
+class QueryPlanner:
+    '''
+    order and prune the paths of an exploration by estimated cost before any of them runs
+    paths are merged into a prefix tree of hops, so a hop shared by several paths is only paid for once,
+    then picked greedily by the cost they add on top of the paths already picked
+
+    latency (seconds per input value) and fan-out (outputs per input value) of every endpoint are learnt
+    from the profiler reports of past explorations, register record with Profiler.add_report_hook
+    endpoints never seen get the average of the known ones, or default_latency and default_fan_out
+    '''
+    def __init__(self, default_latency=0.5, default_fan_out=10):
+        self.default_latency = default_latency
+        self.default_fan_out = default_fan_out
+        # totals of each endpoint over every report: seconds spent in requests, values processed and outputs found
+        self.seconds = {}
+        self.values = {}
+        self.outputs = {}
+
+    '''
+    add the measures of a Profiler report
+    '''
+    def record(self, report):
+        for _endpoint, _stats in report['timings'].get('request', {}).items():
+            self.seconds[_endpoint] = self.seconds.get(_endpoint, 0) + _stats['total']
+        for _endpoint, _count in report['counters'].get('values', {}).items():
+            self.values[_endpoint] = self.values.get(_endpoint, 0) + _count
+        for _endpoint, _count in report['counters'].get('results', {}).items():
+            self.outputs[_endpoint] = self.outputs.get(_endpoint, 0) + _count
+
+    '''
+    (latency, fan-out) estimates of every endpoint seen so far
+    '''
+    def endpoint_stats(self):
+        stats = {}
+        for _endpoint, _values in self.values.items():
+            if _values:
+                stats[_endpoint] = (self.seconds.get(_endpoint, 0) / _values, self.outputs.get(_endpoint, 0) / _values)
+        return stats
+
+    '''
+    list the paths to run, cheapest first
+    every step of the plan is a dict with
+        index: position of the path in paths
+        path: the path, as returned by pathViewer.path_conversion
+        cost: estimated seconds of api calls added by the path, hops shared with earlier steps excluded
+        calls: estimated api requests added by the path, likewise
+        results: estimated number of outputs of its last hop
+    max_paths: keep at most max_paths steps
+    max_calls: leave out the paths which would take the estimated number of requests over max_calls,
+        except the cheapest one, estimates are rough and PathExecutor.max_calls enforces the budget as paths start
+    request_count: function(endpoint, n_values) returning the requests sending n_values inputs to endpoint takes,
+        e.g. SmartAPIHandler.request_count, one request per input by default
+    '''
+    def plan(self, paths, n_values, max_paths=None, max_calls=None, request_count=None):
+        request_count = request_count or (lambda endpoint, n_values: math.ceil(n_values))
+        stats = self.endpoint_stats()
+        default_latency = stats and sum(_stat[0] for _stat in stats.values()) / len(stats) or self.default_latency
+        default_fan_out = stats and sum(_stat[1] for _stat in stats.values()) / len(stats) or self.default_fan_out
+        # estimated (seconds, calls) of every node of the prefix tree, indexed by the hops leading to it
+        nodes = {}
+        prefixes = []
+        results = []
+        for _path in paths:
+            inputs = n_values
+            prefix = ()
+            _prefixes = []
+            for _hop in _path:
+                prefix += ((_hop['input'], _hop['endpoint'], _hop['output']),)
+                (latency, fan_out) = stats.get(_hop['endpoint'], (default_latency, default_fan_out))
+                nodes[prefix] = (inputs * latency, request_count(_hop['endpoint'], inputs))
+                _prefixes.append(prefix)
+                inputs *= fan_out
+            prefixes.append(_prefixes)
+            results.append(inputs)
+        plan = []
+        paid = set()
+        calls = 0
+        remaining = list(range(len(paths)))
+        while remaining and (not max_paths or len(plan) < max_paths):
+            def marginal(i):
+                unpaid = [nodes[_prefix] for _prefix in prefixes[i] if _prefix not in paid]
+                return (sum(_node[0] for _node in unpaid), sum(_node[1] for _node in unpaid))
+            costs = {i: marginal(i) for i in remaining}
+            if max_calls:
+                affordable = [i for i in remaining if calls + costs[i][1] <= max_calls]
+                if not affordable and plan:
+                    break
+                remaining = affordable or remaining
+            best = min(remaining, key=lambda i: (costs[i][0], i))
+            remaining.remove(best)
+            paid.update(prefixes[best])
+            calls += costs[best][1]
+            plan.append({'index': best, 'path': paths[best], 'cost': costs[best][0], 'calls': costs[best][1], 'results': results[best]})
+        return plan
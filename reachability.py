@@ -0,0 +1,109 @@
+class ReachabilityIndex:
+    '''
+    hop distances and path counts between the bioentity types of the api road map, built from its triples
+    types are linked by the endpoints taking one to the other, a hop being a single api call
+
+    distances: fewest hops from a type to another, indexed by start then end, a type only reaches itself through a cycle
+    walks: number of hop sequences of each length, an upper bound of the paths find_path enumerates since those never
+        visit a node twice, counted up to the longest length asked for so far
+    '''
+    def __init__(self, triples=()):
+        # number of endpoints taking a type to another, indexed by input then output type
+        self.links = {}
+        # input and output types of each endpoint
+        self.inputs = {}
+        self.outputs = {}
+        for _triple in triples:
+            _links = self.links.setdefault(_triple['input'], {})
+            _links[_triple['output']] = _links.get(_triple['output'], 0) + 1
+            self.inputs.setdefault(_triple['endpoint'], set()).add(_triple['input'])
+            self.outputs.setdefault(_triple['endpoint'], set()).add(_triple['output'])
+        self.types = set(self.links) | {_output for _links in self.links.values() for _output in _links}
+        self.distances = {_type: self.bfs(_type) for _type in self.types}
+        # walks[start][l - 1][end]: number of walks of l hops from start to end
+        self.walks = {}
+
+    def bfs(self, start):
+        distances = {}
+        frontier = [start]
+        hops = 0
+        while frontier:
+            hops += 1
+            next_frontier = []
+            for _type in frontier:
+                for _output in self.links.get(_type, {}):
+                    if _output not in distances:
+                        distances[_output] = hops
+                        next_frontier.append(_output)
+            frontier = next_frontier
+        return distances
+
+    '''
+    fewest hops from the type start to the type end, None if end can't be reached
+    '''
+    def distance(self, start, end):
+        return self.distances.get(start, {}).get(end)
+
+    '''
+    types reachable from start within max_hops hops, with their distance
+    '''
+    def reachable(self, start, max_hops=None):
+        return {_end: _hops for _end, _hops in self.distances.get(start, {}).items() if not max_hops or _hops <= max_hops}
+
+    '''
+    fewest road map edges from a node (type or endpoint) to the type end, None if end can't be reached
+    two edges, through an endpoint, make one hop
+    '''
+    def steps_to(self, node, end):
+        if node == end:
+            return 0
+        if node in self.types:
+            hops = self.distance(node, end)
+            return hops and 2 * hops
+        steps = [self.steps_to(_output, end) for _output in self.outputs.get(node, ())]
+        steps = [_steps for _steps in steps if _steps is not None]
+        return steps and 1 + min(steps) or None
+
+    '''
+    fewest road map edges from the type start to a node (type or endpoint), None if the node can't be reached
+    '''
+    def steps_from(self, start, node):
+        if node == start:
+            return 0
+        if node in self.types:
+            hops = self.distance(start, node)
+            return hops and 2 * hops
+        steps = [self.steps_from(start, _input) for _input in self.inputs.get(node, ())]
+        steps = [_steps for _steps in steps if _steps is not None]
+        return steps and 1 + min(steps) or None
+
+    '''
+    whether a path from the type start to the type end may go through every intermediate node within max_hops hops
+    intermediate nodes are only checked one at a time, so True does not guarantee a path, but False rules any out
+    '''
+    def feasible(self, start, end, max_hops, intermediate_nodes=()):
+        hops = self.distance(start, end)
+        if hops is None or hops > max_hops:
+            return False
+        for _node in intermediate_nodes:
+            if _node in (start, end):
+                continue
+            to_node = self.steps_from(start, _node)
+            from_node = self.steps_to(_node, end)
+            if to_node is None or from_node is None or to_node + from_node > 2 * max_hops:
+                return False
+        return True
+
+    '''
+    upper bound of the number of paths from the type start to the type end going through at most max_hops apis
+    '''
+    def path_count(self, start, end, max_hops):
+        walks = self.walks.setdefault(start, [])
+        while len(walks) < max_hops:
+            previous = walks[-1] if walks else {start: 1}
+            current = {}
+            for _type, _count in previous.items():
+                for _output, _endpoints in self.links.get(_type, {}).items():
+                    current[_output] = current.get(_output, 0) + _count * _endpoints
+            walks.append(current)
+        return sum(_walks.get(end, 0) for _walks in walks[:max_hops])
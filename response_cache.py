@@ -0,0 +1,152 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ResponseCache:
+    '''
+    two level cache for api call results, an in-memory lru in front of an optional sqlite file
+    entries are indexed by (endpoint, input uri, value, output uri)
+
+    max_entries: number of entries kept in memory, least recently used ones are evicted first
+    ttl: seconds an entry stays valid, None to never expire
+    path: sqlite file backing the memory cache, None to keep everything in memory
+    max_disk_entries: number of entries kept in the sqlite file, oldest ones are evicted first
+    enabled: set to False to bypass the cache, every call then goes to the network
+    '''
+    def __init__(self, max_entries=10000, ttl=86400, path=None, max_disk_entries=1000000, enabled=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.enabled = enabled
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # futures of the calls currently running, so concurrent identical calls wait for the first one
+        self.pending = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+        self.db = None
+        self.disk_writes = 0
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB, expires REAL, created REAL)')
+            self.db.commit()
+
+    def expires(self):
+        return self.ttl and time.time() + self.ttl or None
+
+    '''
+    return (True, value) if key is cached and still valid, (False, None) otherwise
+    '''
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                (expires, value) = self.memory[key]
+                if not expires or expires > time.time():
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return (True, value)
+                del self.memory[key]
+            if self.db:
+                row = self.db.execute('SELECT value, expires FROM responses WHERE key = ?', (json.dumps(key),)).fetchone()
+                if row and (not row[1] or row[1] > time.time()):
+                    value = pickle.loads(row[0])
+                    self.remember(key, value, row[1])
+                    self.stats['disk_hits'] += 1
+                    return (True, value)
+            self.stats['misses'] += 1
+            return (False, None)
+
+    def set(self, key, value):
+        expires = self.expires()
+        with self.lock:
+            self.remember(key, value, expires)
+            if self.db:
+                self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                (json.dumps(key), pickle.dumps(value), expires, time.time()))
+                # evict in chunks, rather than counting rows on every insert
+                self.disk_writes += 1
+                if self.disk_writes % 1000 == 0:
+                    self.evict_disk()
+                self.db.commit()
+
+    def remember(self, key, value, expires):
+        self.memory[key] = (expires, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def evict_disk(self):
+        self.db.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        extra = self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_disk_entries
+        if extra > 0:
+            self.db.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created LIMIT ?)', (extra,))
+
+    '''
+    return the cached value of key, or compute it with func and cache it
+    concurrent calls for the same key wait for the first one instead of computing it again
+    '''
+    def get_or_compute(self, key, func):
+        if not self.enabled:
+            return func()
+        (hit, value) = self.get(key)
+        if hit:
+            return value
+        with self.lock:
+            # the value may have been computed by another thread since the lookup above
+            if key in self.memory:
+                return self.memory[key][1]
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+            else:
+                self.stats['coalesced'] += 1
+        if not owner:
+            return future.result()
+        try:
+            value = func()
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    '''
+    drop every entry of the given endpoints, e.g. after their api changed
+    '''
+    def discard(self, endpoints):
+        endpoints = set(endpoints)
+        with self.lock:
+            for _key in [_key for _key in self.memory if _key[0] in endpoints]:
+                del self.memory[_key]
+            if self.db:
+                for _endpoint in endpoints:
+                    # keys are stored as json lists, starting with the endpoint
+                    prefix = json.dumps([_endpoint])[:-1] + ','
+                    self.db.execute('DELETE FROM responses WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.db:
+                self.db.execute('DELETE FROM responses')
+                self.db.commit()
+
+    def hit_rate(self):
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return total and hits / total or 0.0
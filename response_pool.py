@@ -0,0 +1,221 @@
+'''
+CPU bound processing of api responses (json decoding, id extraction, nquads conversion) in worker processes
+the module is imported by every worker, it must stay free of SmartAPIHandler and anything holding network state
+'''
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from jsonld_processor import jsonld2nquads, fetchvalue, register_context, unregister_context, ContextExtractor
+from utils import int2str
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+'''
+decode a json document, with orjson when available
+orjson refuses integers beyond 64 bits, those documents go through json
+'''
+def loads(content):
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(content)
+
+
+'''
+normalize a response document in place before ids are extracted from it
+'''
+def prepare_document(json_doc, endpoint):
+    int2str(json_doc)
+    if endpoint.startswith('http://myvariant.info/'):
+        if "_id" in json_doc:
+            json_doc["_id"] = json_doc["_id"].replace(':', '-')
+        elif "hits" in json_doc:
+            for _doc in json_doc["hits"]:
+                if "_id" in _doc:
+                    _doc['_id'] = _doc['_id'].replace(":", "-")
+    return json_doc
+
+
+'''
+split a batch response into one document per input value, see SmartAPIHandler.demultiplex
+'''
+def split_hits(json_doc, values, wrap):
+    hits = {_value: [] for _value in values}
+    for _hit in (json_doc if isinstance(json_doc, list) else json_doc.get('hits', [])):
+        if str(_hit.get('query')) in hits and not _hit.get('notfound'):
+            hits[str(_hit.get('query'))].append(_hit)
+    if wrap:
+        return {_value: {'hits': _hits} for _value, _hits in hits.items()}
+    else:
+        return {_value: (_hits and _hits[0] or {}) for _value, _hits in hits.items()}
+
+
+class PathAccessor:
+    '''
+    precompiled accessor for a dotted x-responseValueType path, e.g. "hits.go.BP"
+    lists met along the path are fanned out, missing keys yield nothing instead of raising
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.keys = path.split('.')
+
+    def __call__(self, json_doc):
+        nodes = [json_doc]
+        for _key in self.keys:
+            next_nodes = []
+            for _node in nodes:
+                for _item in (_node if isinstance(_node, list) else [_node]):
+                    if isinstance(_item, dict) and _key in _item:
+                        next_nodes.append(_item[_key])
+            nodes = next_nodes
+        values = []
+        for _node in nodes:
+            if isinstance(_node, list):
+                values += _node
+            else:
+                values.append(_node)
+        return values
+
+
+# version and ContextExtractor of each context url, and PathAccessor of each path, built once per worker process
+worker_contexts = {}
+worker_extractors = {}
+worker_accessors = {}
+
+'''
+register a context in the worker, again whenever its version changes, e.g. after SmartAPIHandler.refresh
+'''
+def load_context(context_url, version, context_doc):
+    if context_url not in worker_contexts or worker_contexts[context_url] != version:
+        unregister_context(context_url)
+        register_context(context_url, context_doc)
+        worker_extractors[context_url] = ContextExtractor(context_doc)
+        worker_contexts[context_url] = version
+
+'''
+extract the outputs of one document as described by spec, see SmartAPIHandler.worker_spec
+'''
+def extract_document(json_doc, spec):
+    (endpoint, output, output_type, mode, context_url, context_version, context_doc, accessor_path, wrap) = spec
+    prepare_document(json_doc, endpoint)
+    if output_type == 'Entity':
+        load_context(context_url, context_version, context_doc)
+        if mode == 'nquads':
+            return (list(set(fetchvalue(jsonld2nquads(json_doc, context_url), output))), output_type)
+        return (worker_extractors[context_url].extract(json_doc, output), output_type)
+    if accessor_path is None:
+        return ([], output_type)
+    if accessor_path not in worker_accessors:
+        worker_accessors[accessor_path] = PathAccessor(accessor_path)
+    return (worker_accessors[accessor_path](json_doc), output_type)
+
+
+'''
+worker entry point, process a chunk of (spec, raw response, batch values) items
+a single response gives (outputs, output type), a batch response a dict of them indexed by value
+'''
+def process_chunk(items):
+    results = []
+    for (_spec, _content, _values) in items:
+        # a broken response only fails its own future, not the whole chunk
+        try:
+            json_doc = loads(_content)
+            if _values is None:
+                results.append((True, extract_document(json_doc, _spec)))
+            else:
+                docs = split_hits(json_doc, _values, _spec[-1])
+                results.append((True, {_value: extract_document(_doc, _spec) for _value, _doc in docs.items()}))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class ResponsePool:
+    '''
+    process pool taking raw api responses, so neither decoding nor extraction holds the GIL of the main process
+    responses submitted close together are sent to a worker as one chunk, amortizing the cost of each round-trip
+
+    processes: number of worker processes, defaults to the number of cores
+    chunk_size: maximum number of responses per chunk
+    chunk_bytes: a chunk is sent as soon as its responses add up to chunk_bytes
+    linger: seconds a partial chunk waits for more responses before it is sent
+
+    workers are started from the dispatcher thread while transport and executor threads run,
+    a forked worker could inherit one of their locks held, so they start from a forkserver (spawn where there is none)
+    '''
+    def __init__(self, processes=None, chunk_size=16, chunk_bytes=1 << 20, linger=0.002):
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.chunk_bytes = chunk_bytes
+        self.linger = linger
+        start_method = 'forkserver' in multiprocessing.get_all_start_methods() and 'forkserver' or 'spawn'
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context(start_method))
+        self.queue = queue.Queue()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    '''
+    queue a raw response for processing, return a Future of its result
+    the result is (outputs, output type), or a dict of them indexed by value when the batch values are given
+    '''
+    def submit(self, spec, content, values=None):
+        future = Future()
+        self.queue.put((future, (spec, content, values)))
+        return future
+
+    def dispatch(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            chunk = [item]
+            size = len(item[1][1])
+            deadline = time.time() + self.linger
+            while len(chunk) < self.chunk_size and size < self.chunk_bytes:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.send(chunk)
+                    return
+                chunk.append(item)
+                size += len(item[1][1])
+            self.send(chunk)
+
+    def send(self, chunk):
+        futures = [_future for (_future, _) in chunk]
+        try:
+            task = self.executor.submit(process_chunk, [_item for (_, _item) in chunk])
+        except Exception as e:
+            for _future in futures:
+                _future.set_exception(e)
+            return
+        def done(task):
+            try:
+                for _future, (_ok, _result) in zip(futures, task.result()):
+                    if _ok:
+                        _future.set_result(_result)
+                    else:
+                        _future.set_exception(_result)
+            except Exception as e:
+                for _future in futures:
+                    if not _future.done():
+                        _future.set_exception(e)
+        task.add_done_callback(done)
+
+    def shutdown(self):
+        self.queue.put(None)
+        self.dispatcher.join()
+        self.executor.shutdown()
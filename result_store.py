@@ -0,0 +1,165 @@
+import json
+from array import array
+
+import numpy as np
+
+
+class ResultTable:
+    '''
+    columnar store for the records of path explorations, see pathViewer.iter_output
+    every id, relation and path is interned once, rows only hold integer codes
+    to_frame exposes the rows as a pandas DataFrame of categorical columns:
+    path, start_value, hop, input_id, output_id, relation, endpoint, input_type, output_type
+    '''
+    def __init__(self):
+        # interned ids (start values, inputs and outputs), original values and their labels
+        self.values = []
+        self.labels = []
+        self.codes = {}
+        self.relations = []
+        self.relation_codes = {}
+        # hops of each path, indexed by path name
+        self.paths = {}
+        self.path_names = []
+        self.output_types = {}
+        self.starts = {}
+        self.columns = {'path': array('i'), 'start_value': array('i'), 'hop': array('b'),
+                        'input_id': array('i'), 'output_id': array('i'), 'relation': array('i')}
+
+    def intern(self, value):
+        label = value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+        if label not in self.codes:
+            self.codes[label] = len(self.values)
+            self.values.append(value)
+            self.labels.append(label)
+        return self.codes[label]
+
+    def intern_relation(self, relation):
+        # object outputs have no relation
+        relation = relation or ''
+        if relation not in self.relation_codes:
+            self.relation_codes[relation] = len(self.relations)
+            self.relations.append(relation)
+        return self.relation_codes[relation]
+
+    '''
+    append the records of a path
+    path: hops of the path, as returned by pathViewer.path_conversion
+    output_types: bioentity type ('Entity' or 'Object') of the output of each hop
+    '''
+    def add(self, path_name, path, value, records, output_types):
+        if path_name not in self.paths:
+            self.paths[path_name] = path
+            self.path_names.append(path_name)
+            self.output_types[path_name] = output_types
+            self.starts[path_name] = {}
+        path_code = self.path_names.index(path_name)
+        for _value in value:
+            self.starts[path_name][_value] = None
+        columns = self.columns
+        for (_start, _hop, _input, _output, _relation) in records:
+            columns['path'].append(path_code)
+            columns['start_value'].append(self.intern(_start))
+            columns['hop'].append(_hop)
+            columns['input_id'].append(self.intern(_input))
+            columns['output_id'].append(self.intern(_output))
+            columns['relation'].append(self.intern_relation(_relation))
+
+    def __len__(self):
+        return len(self.columns['path'])
+
+    '''
+    yield the records of a path back, in the order they were added
+    '''
+    def iter_records(self, path_name):
+        path_code = self.path_names.index(path_name)
+        columns = self.columns
+        for i in np.flatnonzero(np.frombuffer(columns['path'], dtype=np.int32) == path_code):
+            yield (self.values[columns['start_value'][i]], columns['hop'][i], self.values[columns['input_id'][i]],
+                   self.values[columns['output_id'][i]], self.relations[columns['relation'][i]] or None)
+
+    '''
+    results of the last hop of each path, in the format of pathViewer.final_results
+    '''
+    def final_results(self):
+        results = {}
+        for _name in self.path_names:
+            path = self.paths[_name]
+            results[_name] = {_start: [] for _start in self.starts[_name]}
+            for (_start, _hop, _input, _output, _relation) in self.iter_records(_name):
+                if _hop == len(path) - 1:
+                    if self.output_types[_name][-1] == 'Entity':
+                        results[_name][_start].append(path[-1]['output'] + ':' + _output)
+                    else:
+                        results[_name][_start].append(_output)
+        return results
+
+    '''
+    per path and hop attribute (endpoint, input_type, output_type) expanded to one categorical per row
+    '''
+    def hop_column(self, key, path_codes, hops):
+        import pandas as pd
+        max_hops = max([len(_path) for _path in self.paths.values()] or [1])
+        labels = []
+        lookup = np.zeros(len(self.path_names) * max_hops, dtype=np.int32)
+        for i, _name in enumerate(self.path_names):
+            for j, _hop in enumerate(self.paths[_name]):
+                if _hop[key] not in labels:
+                    labels.append(_hop[key])
+                lookup[i * max_hops + j] = labels.index(_hop[key])
+        return pd.Categorical.from_codes(lookup[path_codes * max_hops + hops], categories=labels)
+
+    def to_frame(self):
+        # pandas is loaded on first use, records can be stored and streamed back without it
+        import pandas as pd
+        columns = self.columns
+        path_codes = np.frombuffer(columns['path'], dtype=np.int32)
+        hops = np.frombuffer(columns['hop'], dtype=np.int8)
+        ids = pd.Index(self.labels)
+        frame = pd.DataFrame({
+            'path': pd.Categorical.from_codes(path_codes, categories=self.path_names),
+            'start_value': pd.Categorical.from_codes(np.frombuffer(columns['start_value'], dtype=np.int32), categories=ids),
+            'hop': hops,
+            'input_id': pd.Categorical.from_codes(np.frombuffer(columns['input_id'], dtype=np.int32), categories=ids),
+            'output_id': pd.Categorical.from_codes(np.frombuffer(columns['output_id'], dtype=np.int32), categories=ids),
+            'relation': pd.Categorical.from_codes(np.frombuffer(columns['relation'], dtype=np.int32), categories=self.relations),
+        })
+        for _key, _column in (('endpoint', 'endpoint'), ('input', 'input_type'), ('output', 'output_type')):
+            frame[_column] = self.hop_column(_key, path_codes.astype(np.int64), hops.astype(np.int64))
+        return frame
+
+    '''
+    arrow table of the results, categorical columns become dictionary arrays sharing the interned ids
+    '''
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.Table.from_pandas(self.to_frame(), preserve_index=False)
+
+    def to_parquet(self, path, **kwargs):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), path, **kwargs)
+
+    def to_feather(self, path, **kwargs):
+        import pyarrow.feather as feather
+        feather.write_feather(self.to_arrow(), path, **kwargs)
+
+    def group_by_start(self):
+        return self.to_frame().groupby(['path', 'start_value'], observed=True)
+
+    '''
+    one row per chain of hops from a start value to an output of the last hop of a path
+    columns: start_value, then hop<i>_output and hop<i>_relation for each hop
+    '''
+    def join_hops(self, path_name):
+        frame = self.to_frame()
+        frame = frame[frame['path'] == path_name]
+        joined = None
+        for i in range(len(self.paths[path_name])):
+            hop = frame[frame['hop'] == i][['start_value', 'input_id', 'output_id', 'relation']].rename(
+                columns={'output_id': 'hop{}_output'.format(i), 'relation': 'hop{}_relation'.format(i)})
+            if joined is None:
+                joined = hop.drop(columns='input_id')
+            else:
+                joined = joined.merge(hop, left_on=['start_value', 'hop{}_output'.format(i - 1)],
+                                      right_on=['start_value', 'input_id']).drop(columns='input_id')
+        return joined.reset_index(drop=True)
@@ -0,0 +1,188 @@
+import random
+import sys
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# status codes worth retrying, 429 asks to slow down, 5xx are usually transient
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    '''
+    raised instead of sending a request to a host whose circuit is open
+    '''
+
+
+class Transport:
+    '''
+    shared http layer for registry files, jsonld contexts and api calls
+    every host (i.e. every api) gets its own timeout, rate limit and circuit breaker
+
+    timeout: seconds to wait for a connection or a response
+    timeouts: timeout overrides indexed by host, e.g. {'myvariant.info': 120}
+    retries: number of times a request is retried after a connection error, a timeout, a 429 or a 5xx
+    backoff: seconds to wait before the first retry, doubled on each following retry, up to max_backoff
+    rate_limit: maximum requests per second sent to a single host, None for no limit
+    rate_limits: rate_limit overrides indexed by host
+    failure_threshold: consecutive failed requests after which a host is marked degraded
+    reset_timeout: seconds a degraded host is left alone before a single trial request is let through
+    pool_size: number of keep-alive connections kept per host
+    '''
+    def __init__(self, timeout=30, timeouts=None, retries=3, backoff=0.5, max_backoff=30, rate_limit=None, rate_limits=None,
+                 failure_threshold=5, reset_timeout=60, pool_size=16):
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limit = rate_limit
+        self.rate_limits = rate_limits or {}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        # earliest time the next request may be sent to each host, from rate limits and Retry-After headers
+        self.next_slot = {}
+        # consecutive failures of each host, and when its circuit was opened
+        self.failures = {}
+        self.opened = {}
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0}
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    '''
+    send a request, retrying with exponential backoff on connection errors, timeouts, 429 and 5xx
+    the last response is returned even if its status is still an error, connection errors are raised
+    raise CircuitOpenError if the host is degraded
+    '''
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        kwargs.setdefault('timeout', self.timeouts.get(host, self.timeout))
+        for attempt in range(self.retries + 1):
+            self.admit(host)
+            self.wait_for_slot(host)
+            with self.lock:
+                self.stats['requests'] += 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.record_failure(host)
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    self.record_success(host)
+                    return response
+                retry_after = self.retry_after(response)
+                if retry_after:
+                    self.delay(host, retry_after)
+                # a host asking to slow down is still up
+                if response.status_code != 429:
+                    self.record_failure(host)
+                if attempt == self.retries:
+                    return response
+            with self.lock:
+                self.stats['retries'] += 1
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+            time.sleep(delay * random.uniform(0.5, 1))
+
+    '''
+    raise CircuitOpenError if the circuit of host is open
+    once reset_timeout has passed, a single trial request is let through, and the circuit closes if it succeeds
+    '''
+    def admit(self, host):
+        with self.lock:
+            if host not in self.opened:
+                return
+            if time.time() - self.opened[host] < self.reset_timeout:
+                self.stats['rejected'] += 1
+                raise CircuitOpenError('{} is degraded after {} consecutive failures'.format(host, self.failures[host]))
+            # half open, hold the other requests back until the trial request is done
+            self.opened[host] = time.time()
+
+    def record_success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.opened.pop(host, None)
+
+    def record_failure(self, host):
+        with self.lock:
+            self.stats['failures'] += 1
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.failure_threshold:
+                if host not in self.opened:
+                    print('{} marked as degraded after {} consecutive failures'.format(host, self.failures[host]), file=sys.stderr)
+                self.opened[host] = time.time()
+
+    '''
+    whether the circuit of the host of url is open, i.e. requests to it fail fast
+    '''
+    def is_degraded(self, url):
+        host = urlparse(url).netloc or url
+        with self.lock:
+            return host in self.opened and time.time() - self.opened[host] < self.reset_timeout
+
+    def degraded_hosts(self):
+        with self.lock:
+            return [_host for _host, _opened in self.opened.items() if time.time() - _opened < self.reset_timeout]
+
+    '''
+    sleep until a request may be sent to host, according to its rate limit and Retry-After headers
+    '''
+    def wait_for_slot(self, host):
+        rate = self.rate_limits.get(host, self.rate_limit)
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.get(host, now))
+            if rate:
+                self.next_slot[host] = slot + 1.0 / rate
+            elif slot > now:
+                self.next_slot[host] = slot
+        if slot > now:
+            time.sleep(slot - now)
+
+    def delay(self, host, seconds):
+        with self.lock:
+            self.next_slot[host] = max(self.next_slot.get(host, 0), time.time() + seconds)
+
+    '''
+    seconds asked for by the Retry-After header of response, which holds either seconds or an http date
+    '''
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0), self.max_backoff)
+
+
+default_transport = None
+default_transport_lock = threading.Lock()
+
+'''
+Transport shared by everything not given one of its own, created on first use
+'''
+def get_default_transport():
+    global default_transport
+    with default_transport_lock:
+        if default_transport is None:
+            default_transport = Transport()
+        return default_transport